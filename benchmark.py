@@ -0,0 +1,223 @@
+
+import argparse
+import datetime as dt
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+from collections import OrderedDict
+import numpy as np
+from simulation import Simulation
+from instrumentation import Instrumentation
+
+# daily task creation
+LOADS = [4000, 16000, 100000]
+# simulated days
+HORIZONS = [1, 15, 60]
+# (ss_capability, os_capability) from a growing backlog to mostly idle staff
+CAPACITIES = OrderedDict([('backlog', (5, 40)), ('default', (11, 88)), ('idle', (40, 300))])
+SUITES = {
+    'quick': {'create_cnt': [4000, 16000], 'run_time_days': [1], 'capacity': list(CAPACITIES)},
+    'full': {'create_cnt': LOADS, 'run_time_days': HORIZONS, 'capacity': list(CAPACITIES)},
+}
+# metrics where larger is worse, and where smaller is worse
+COST_METRICS = ['run_time', 'run_peak_memory', 'logging_time', 'logging_peak_memory']
+RATE_METRICS = ['events_per_second']
+HISTORY_PATH = 'benchmark_history.json'
+# modules a process pool worker imports, each must load within the budget in seconds
+WORKER_MODULES = ['simulation', 'sweep']
+IMPORT_TIME_BUDGET = 0.3
+# modules only plotting and reporting may load
+HEAVY_MODULES = ['pandas', 'matplotlib', 'scipy']
+_IMPORT_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+print(json.dumps([time.perf_counter() - start, [name for name in {heavy!r} if name in sys.modules]]))
+'''
+
+
+def suite_cases(suite):
+    grid = SUITES[suite]
+    cases = OrderedDict()
+    for create_cnt, days, capacity in itertools.product(grid['create_cnt'], grid['run_time_days'],
+                                                        grid['capacity']):
+        ss_capability, os_capability = CAPACITIES[capacity]
+        name = 'cnt{}_days{}_{}'.format(create_cnt, days, capacity)
+        cases[name] = {'create_cnt': create_cnt, 'run_time_days': days,
+                       'ss_capability': ss_capability, 'os_capability': os_capability}
+    return cases
+
+
+def _measured_run(params, seed, trace_memory, sim_kwargs):
+    np.random.seed(seed)
+    sim = Simulation(os.devnull, show_logging=False, init_paras_from_text=False, **sim_kwargs)
+    sim.set_params(**params)
+    sim.instrumentation = Instrumentation(trace_memory=trace_memory, top_allocations=0)
+    sim.run()
+    sim.logging()
+    return sim.instrumentation.report()
+
+
+def benchmark_case(params, seed=0, memory=True, sim_kwargs=None, repeat=3):
+    """
+    time run() and logging() of one case, best of repeat runs with the same
+    seed, the peak memory comes from one more run under tracemalloc so that
+    it does not slow the timed ones
+    """
+    sim_kwargs = sim_kwargs or {}
+    reports = [_measured_run(params, seed, False, sim_kwargs) for _ in range(repeat)]
+    report = reports[0]
+    run_time = min(report['phases']['run']['wall_time'] for report in reports)
+    logging_time = min(report['phases']['logging']['wall_time'] for report in reports)
+    events = sum(stats['tasks_entered'] + stats['tasks_left'] for stats in report['processors'].values())
+    result = OrderedDict([('run_time', run_time),
+                          ('logging_time', logging_time),
+                          ('events', events),
+                          ('events_per_second', events / run_time),
+                          ('simulated_minutes_per_second', report['simulated_minutes'] / run_time)])
+    if memory:
+        phases = _measured_run(params, seed, True, sim_kwargs)['phases']
+        result['run_peak_memory'] = phases['run']['peak_memory']
+        result['logging_peak_memory'] = phases['logging']['peak_memory']
+    return result
+
+
+def import_time(module, repeat=5):
+    """
+    best import time of a module in fresh interpreters, and the heavy modules it loads
+    """
+    times = []
+    heavy = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', _IMPORT_PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                                         cwd=os.path.dirname(os.path.abspath(__file__)))
+        seconds, heavy = json.loads(output.decode().strip().splitlines()[-1])
+        times.append(seconds)
+    return min(times), heavy
+
+
+def check_imports(budget=IMPORT_TIME_BUDGET, repeat=5, verbose=True):
+    # True if every worker module imports within the budget without heavy modules
+    ok = True
+    for module in WORKER_MODULES:
+        seconds, heavy = import_time(module, repeat)
+        passed = seconds <= budget and not heavy
+        ok = ok and passed
+        if verbose:
+            print('{:<12} {:.3f}s{}{}'.format(module, seconds, ' loads ' + ', '.join(heavy) if heavy else '',
+                                             '' if passed else '  OVER BUDGET'))
+    return ok
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(suite='quick', seed=0, memory=True, history_path=HISTORY_PATH, sim_kwargs=None, repeat=3,
+              verbose=True):
+    # run every case of a suite and append the results to the history file
+    results = OrderedDict()
+    for name, params in suite_cases(suite).items():
+        results[name] = benchmark_case(params, seed, memory, sim_kwargs, repeat)
+        if verbose:
+            print('{}: run {:.2f}s, logging {:.3f}s, {:.0f} events/s'.format(
+                name, results[name]['run_time'], results[name]['logging_time'],
+                results[name]['events_per_second']))
+    entry = OrderedDict([('time', dt.datetime.now().isoformat()),
+                         ('commit', _git_commit()),
+                         ('python', platform.python_version()),
+                         ('numpy', np.__version__),
+                         ('suite', suite),
+                         ('seed', seed),
+                         ('repeat', repeat),
+                         ('sim_kwargs', sim_kwargs or {}),
+                         ('results', results)])
+    history = load_history(history_path)
+    history.append(entry)
+    with open(history_path, 'w') as f:
+        json.dump(history, f, indent=2)
+    return entry
+
+
+def load_history(history_path=HISTORY_PATH):
+    if not os.path.exists(history_path):
+        return []
+    with open(history_path, 'r') as f:
+        return json.load(f)
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+    relative change of every metric of the cases in both entries
+    :return: list of (case, metric, baseline value, current value, change, regressed)
+    """
+    rows = []
+    for case, result in current['results'].items():
+        if case not in baseline['results']:
+            continue
+        base = baseline['results'][case]
+        for metric in COST_METRICS + RATE_METRICS:
+            if metric not in result or metric not in base or not base[metric]:
+                continue
+            change = result[metric] / base[metric] - 1
+            if metric in RATE_METRICS:
+                regressed = change < -threshold
+            else:
+                regressed = change > threshold
+            rows.append((case, metric, base[metric], result[metric], change, regressed))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='simulation engine benchmarks')
+    parser.add_argument('--history', default=HISTORY_PATH)
+    commands = parser.add_subparsers(dest='command')
+    run_parser = commands.add_parser('run', help='run a suite and append it to the history')
+    run_parser.add_argument('--suite', default='quick', choices=sorted(SUITES))
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--repeat', type=int, default=3, help='timed runs per case, the best is kept')
+    run_parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    run_parser.add_argument('--event-driven', action='store_true')
+    run_parser.add_argument('--columnar-store', action='store_true')
+    run_parser.add_argument('--streaming-metrics', action='store_true')
+    compare_parser = commands.add_parser('compare', help='compare two history entries')
+    compare_parser.add_argument('--baseline', type=int, default=-2, help='history index of the baseline')
+    compare_parser.add_argument('--current', type=int, default=-1, help='history index to check')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='relative change reported as a regression')
+    imports_parser = commands.add_parser('imports', help='check the import time of worker modules')
+    imports_parser.add_argument('--budget', type=float, default=IMPORT_TIME_BUDGET, help='seconds per module')
+    imports_parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        sim_kwargs = {name: True for name in ['event_driven', 'columnar_store', 'streaming_metrics']
+                      if getattr(args, name)}
+        run_suite(args.suite, args.seed, not args.no_memory, args.history, sim_kwargs, args.repeat)
+        return 0
+    if args.command == 'imports':
+        return int(not check_imports(args.budget, args.repeat))
+    if args.command == 'compare':
+        history = load_history(args.history)
+        if len(history) < 2:
+            print('need two benchmark runs in {}'.format(args.history))
+            return 1
+        rows = compare(history[args.baseline], history[args.current], args.threshold)
+        for case, metric, base, value, change, regressed in rows:
+            print('{:<32} {:<22} {:>14.4g} {:>14.4g} {:>+8.1%}{}'.format(
+                case, metric, base, value, change, '  REGRESSION' if regressed else ''))
+        return int(any(row[-1] for row in rows))
+    parser.print_help()
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,192 @@
+
+import json
+import os
+import numpy as np
+import datetime as dt
+from utils import SIMULATION_START
+from schedule import MINUTES_PER_DAY
+from metrics import ResultColumns, VOUCHER_PROCESSORS
+
+# one fixed width record per enter_processor / leave_processor event
+TRACE_DTYPE = np.dtype([('task', '<i8'), ('processor', '<i2'), ('event', 'u1'),
+                        ('time', '<f8'), ('process_time', '<f4')])
+TRACE_ENTER = 0
+TRACE_LEAVE = 1
+
+
+class TraceWriter(object):
+    """
+    buffered writer of task events to a raw record file, the processor
+    names and record count go to a json file next to it on close
+    """
+    def __init__(self, path, chunk_records=65536, metadata=None):
+        self.path = path
+        self.metadata = metadata or {}
+        self.processor_names = []
+        self._processor_ids = {}
+        # ids of tasks without an int index
+        self._task_ids = {}
+        self.record_count = 0
+        self._buffer = np.empty(chunk_records, dtype=TRACE_DTYPE)
+        self._buffered = 0
+        self._file = open(path, 'wb')
+
+    def record(self, task, taskbase, event, process_time=None):
+        pid = self._processor_ids.get(taskbase.name)
+        if pid is None:
+            pid = len(self.processor_names)
+            self._processor_ids[taskbase.name] = pid
+            self.processor_names.append(taskbase.name)
+        task_id = task.index
+        if task_id is None:
+            task_id = self._task_ids.setdefault(task.id, len(self._task_ids))
+        self._buffer[self._buffered] = (task_id, pid, event, taskbase.env.now,
+                                        -1 if process_time is None else process_time)
+        self._buffered += 1
+        if self._buffered >= len(self._buffer):
+            self.flush()
+
+    def flush(self):
+        if self._buffered:
+            self._file.write(self._buffer[:self._buffered].tobytes())
+            self.record_count += self._buffered
+            self._buffered = 0
+
+    def close(self):
+        self.flush()
+        self._file.close()
+        with open(self.path + '.json', 'w') as f:
+            json.dump({'record_count': self.record_count,
+                       'processor_names': self.processor_names,
+                       'dtype': TRACE_DTYPE.descr,
+                       'metadata': self.metadata}, f)
+
+
+class TraceTimeStamp(object):
+    """
+    read only view of one trace record, mirroring TaskTimeStamp
+    """
+    __slots__ = ('trace', 'row')
+
+    def __init__(self, trace, row):
+        self.trace = trace
+        self.row = row
+
+    @property
+    def processor(self):
+        return self.trace.processor_names[self.trace.records['processor'][self.row]]
+
+    @property
+    def minute(self):
+        return float(self.trace.records['time'][self.row])
+
+    @property
+    def clock_minute(self):
+        return self.minute % MINUTES_PER_DAY
+
+    @property
+    def time(self):
+        return SIMULATION_START + dt.timedelta(minutes=self.minute)
+
+    @property
+    def process_time(self):
+        return float(self.trace.records['process_time'][self.row])
+
+
+class TraceTask(object):
+    """
+    task rebuilt from the records of one task id in a trace
+    """
+    __slots__ = ('trace', 'index', 'rows')
+
+    def __init__(self, trace, index, rows):
+        self.trace = trace
+        self.index = index
+        self.rows = rows
+
+    @property
+    def id(self):
+        # the int id of the traced task
+        return self.index
+
+    @property
+    def time_stamps(self):
+        return [TraceTimeStamp(self.trace, row) for row in self.rows]
+
+    def time_consuming(self, voucher_processor_name=None, with_voucher=False):
+        records = self.trace.records[self.rows]
+        times = records['time']
+        time_consuming = times[-1] - times[0]
+        if not with_voucher:
+            voucher_ids = [self.trace.processor_id(name) for name in voucher_processor_name or []]
+            voucher_times = times[np.isin(records['processor'], voucher_ids)]
+            pair_count = int(len(voucher_times) / 2)
+            time_consuming -= np.sum(voucher_times[1:2*pair_count:2] - voucher_times[0:2*pair_count:2])
+        return dt.timedelta(minutes=float(time_consuming))
+
+
+class EventTrace(object):
+    """
+    trace file mapped into memory, tasks are rebuilt on demand
+    """
+    def __init__(self, path):
+        with open(path + '.json', 'r') as f:
+            info = json.load(f)
+        self.path = path
+        self.processor_names = info['processor_names']
+        self.metadata = info['metadata']
+        self.record_count = info['record_count']
+        if self.record_count:
+            self.records = np.memmap(path, dtype=TRACE_DTYPE, mode='r', shape=(self.record_count,))
+        else:
+            self.records = np.empty(0, dtype=TRACE_DTYPE)
+        self._order = None
+        self._task_ids = None
+        self._task_starts = None
+
+    def processor_id(self, name):
+        # -1 for a processor that never appears in the trace
+        return self.processor_names.index(name) if name in self.processor_names else -1
+
+    def _group_tasks(self):
+        # record rows of each task, in time order, found once with a stable sort
+        if self._order is None:
+            tasks = self.records['task']
+            self._order = np.argsort(tasks, kind='stable')
+            self._task_ids, self._task_starts = np.unique(tasks[self._order], return_index=True)
+            self._task_starts = np.append(self._task_starts, len(self._order))
+
+    def task(self, index):
+        self._group_tasks()
+        position = np.searchsorted(self._task_ids, index)
+        if position >= len(self._task_ids) or self._task_ids[position] != index:
+            raise KeyError('task {} is not in the trace'.format(index))
+        return TraceTask(self, index, self._order[self._task_starts[position]:self._task_starts[position + 1]])
+
+    def result_tasks(self, result_processor='finished tasks'):
+        # tasks in the order they entered the result processor
+        pid = self.processor_id(result_processor)
+        rows = np.nonzero((self.records['processor'] == pid) & (self.records['event'] == TRACE_ENTER))[0]
+        for index in self.records['task'][rows]:
+            yield self.task(index)
+
+    def result_columns(self, voucher_processor_name=VOUCHER_PROCESSORS, result_processor='finished tasks'):
+        pid = self.processor_id(result_processor)
+        records = self.records
+        rows = np.nonzero((records['processor'] == pid) & (records['event'] == TRACE_ENTER))[0]
+        return ResultColumns.from_stamps(records['task'], records['processor'], records['time'],
+                                         self.processor_names, records['task'][rows], voucher_processor_name)
+
+    def logging(self, network=None, result_processor='finished tasks'):
+        # the Simulation.logging metrics of the traced run under the tables of network, the default one if None
+        if network is None:
+            # network imports task, which imports this module
+            from network import DEFAULT_NETWORK as network
+        return self.result_columns(network.voucher_stages, result_processor).results(
+            network.intime_condition, network.system_time, network.work_stages)
+
+
+def load_trace(path):
+    if not os.path.exists(path + '.json'):
+        raise IOError('trace {} was not closed or does not exist'.format(path))
+    return EventTrace(path)
@@ -0,0 +1,319 @@
+
+import itertools
+import numpy as np
+from utils import Task_Generation_Distribution
+from network import DEFAULT_NETWORK
+from metrics import steady_days
+from schedule import minute_of_day
+
+# parameters that may differ between the points of one fluid run
+VECTOR_ATTRS = ['ss_capability', 'ss_process_time', 'os_capability', 'os_process_time',
+                'create_cnt', 'create_cancel', 'create_cs', 'create_os', 'cs_finish',
+                'os_voucher', 'os_voucher_os', 'os_finish_ss', 'ss_voucher', 'ss_voucher_ss']
+# stages whose backlog and throughput are recorded
+FLUID_STAGES = ['cs_processor', 'os_processor', 'os_voucher_processor', 'ss_processor',
+                'ss_voucher_processor', 'finished tasks', 'unfinished tasks']
+EPS = 1e-9
+
+
+class FluidResult(object):
+    """
+    results of a fluid run, every array has one row per parameter point
+    """
+    def __init__(self, params, run_minutes, sample_minutes):
+        self.params = params
+        self.run_minutes = run_minutes
+        self.sample_minutes = sample_minutes
+        self.mean_time = None
+        self.completion_in24_rate = None
+        # last finish hour of the stage on each day
+        self.os_work_time = None
+        self.ss_work_time = None
+        self.mean_os_work_time = None
+        self.mean_ss_work_time = None
+        # stage -> tasks waiting or in process at each sample minute
+        self.backlog = {}
+        # stage -> tasks that left the stage up to each sample minute
+        self.throughput = {}
+
+    @property
+    def point_count(self):
+        return len(self.mean_time)
+
+    def points(self):
+        return [dict((name, values[i]) for name, values in self.params.items())
+                for i in range(self.point_count)]
+
+
+class _FluidStage(object):
+    """
+    fluid queue of an InnerTaskProcessor: the head holds tasks it may take
+    after the end time, the tail those which wait for the next start
+    """
+    def __init__(self, count, rate):
+        self.rate = rate
+        self.head = np.zeros(count)
+        self.tail = np.zeros(count)
+        # returning voucher tasks in the queue, they skip the voucher check
+        self.returned = np.zeros(count)
+        self.busy = np.zeros(count, dtype=bool)
+        self.arrived = 0.
+        self.served = 0.
+
+    @property
+    def backlog(self):
+        return self.head + self.tail
+
+    def arrive(self, tasks, returned, in_window, after_last_task_time):
+        if in_window:
+            self.head += self.tail + tasks
+            self.tail[:] = 0
+        elif after_last_task_time:
+            self.tail += tasks
+        else:
+            # after midnight tasks may be taken only if no late task is ahead of them
+            late = self.tail > EPS
+            self.tail += np.where(late, tasks, 0)
+            self.head += np.where(late, 0, tasks)
+        self.returned += returned
+        self.arrived = self.arrived + tasks
+
+    def serve(self, in_window, extend_working):
+        total = self.head + self.tail
+        if in_window:
+            served = np.minimum(self.rate, self.head)
+        elif extend_working:
+            # the processor keeps working only while it has tasks in process
+            served = np.where(self.busy, np.minimum(self.rate, self.head), 0)
+        else:
+            served = np.zeros_like(self.head)
+        self.head -= served
+        self.busy = served > EPS
+        # returning tasks are assumed spread evenly in the queue
+        served_returned = np.where(total > EPS, served * self.returned / np.maximum(total, EPS), 0)
+        served_returned = np.minimum(served_returned, self.returned)
+        self.returned -= served_returned
+        self.served = self.served + served
+        return served, served_returned
+
+
+def _exit_minutes(arrived, served, enter_minutes, process_time):
+    """
+    fifo exit time of the tasks entering a stage at enter_minutes, found by
+    inverting the cumulative arrival and departure curves of each point
+    """
+    count, minutes = served.shape
+    valid = np.isfinite(enter_minutes)
+    index = np.where(valid, np.minimum(enter_minutes, minutes - 1), 0).astype(np.int64)
+    rows = np.arange(count)[:, None]
+    # position of the middle of the cohort in the queue
+    previous = np.where(index > 0, arrived[rows, np.maximum(index - 1, 0)], 0)
+    position = (previous + arrived[rows, index]) / 2
+    offset = (np.arange(count) * (served[:, -1].max() + arrived[:, -1].max() + 1))[:, None]
+    flat = (served + offset).ravel()
+    found = np.searchsorted(flat, (position + offset - EPS).ravel()).reshape(count, -1)
+    found = found - np.arange(count)[:, None] * minutes
+    exit_minutes = np.maximum(found, index) + process_time
+    return np.where(valid & (found < minutes), exit_minutes.astype(float), np.inf)
+
+
+def fluid_run(sim, sample_interval=10, cohort_interval=5, chunk_size=256, **overrides):
+    """
+    approximate the simulation network with expected task counts moved
+    between stages in one minute buckets
+    :param sim: Simulation whose parameters are used
+    :param sample_interval: minutes between recorded backlog samples
+    :param cohort_interval: minutes of created tasks followed through the network
+                            together to estimate the aging, a divisor of 60
+    :param chunk_size: parameter points run together
+    :param overrides: attribute of VECTOR_ATTRS -> value or list of values, one per point
+    :return: FluidResult
+    """
+    for name in overrides:
+        if name not in VECTOR_ATTRS:
+            raise AttributeError('fluid run can not vary attribution {}'.format(name))
+    count = max([np.size(value) for value in overrides.values()] + [1])
+    params = dict((name, np.broadcast_to(np.asarray(overrides.get(name, getattr(sim, name)), dtype=float),
+                                         (count,)).copy())
+                  for name in VECTOR_ATTRS)
+    run_minutes = int(round(sim.run_time))
+    result = FluidResult(params, run_minutes, np.arange(0, run_minutes, sample_interval))
+    parts = [_fluid_chunk(sim, dict((name, values[start:start + chunk_size]) for name, values in params.items()),
+                          run_minutes, sample_interval, cohort_interval)
+             for start in range(0, count, chunk_size)]
+    for name in ['mean_time', 'completion_in24_rate', 'os_work_time', 'ss_work_time',
+                 'mean_os_work_time', 'mean_ss_work_time']:
+        setattr(result, name, np.concatenate([part[name] for part in parts]))
+    for stage in FLUID_STAGES:
+        result.backlog[stage] = np.concatenate([part['backlog'][stage] for part in parts])
+        result.throughput[stage] = np.concatenate([part['throughput'][stage] for part in parts])
+    return result
+
+
+def fluid_grid(sim, param_grid, sample_interval=10, cohort_interval=5, chunk_size=256):
+    """
+    fluid run of every point of a parameter grid, points in itertools.product order
+    """
+    names = list(param_grid.keys())
+    points = list(itertools.product(*[param_grid[name] for name in names]))
+    overrides = dict((name, [point[i] for point in points]) for i, name in enumerate(names))
+    return fluid_run(sim, sample_interval, cohort_interval, chunk_size, **overrides)
+
+
+def _fluid_chunk(sim, p, run_minutes, sample_interval, cohort_interval):
+    count = len(p['ss_capability'])
+    start = minute_of_day(sim.start_time)
+    end = minute_of_day(sim.end_time)
+    last_task_time = minute_of_day(sim.last_task_time)
+    extend_working = bool(sim.extend_working)
+    days = int(np.ceil(run_minutes / 1440))
+    # expected new tasks per minute of each hour, (count, 24)
+    lam = (p['create_cnt'] * (1 - p['create_cancel']) / 60)[:, None] * Task_Generation_Distribution[None, :]
+    create_ss = 1 - p['create_cs'] - p['create_os']
+    # crowd sourcing: unbounded, each task takes cs_process_time working minutes
+    cs_minutes = max(int(np.ceil(sim.cs_process_time)), 1)
+    cs_ring = np.zeros((cs_minutes, count))
+    cs_cache = np.zeros(count)
+    cs_work_minutes = 0
+    os_stage = _FluidStage(count, p['os_capability'] / p['os_process_time'])
+    ss_stage = _FluidStage(count, p['ss_capability'] / p['ss_process_time'])
+    os_returning = np.zeros(count)
+    ss_returning = np.zeros(count)
+    finished = np.zeros(count)
+    unfinished = np.zeros(count)
+    # cumulative curves for the fifo delays
+    curves = dict((name, np.zeros((run_minutes, count), dtype=np.float32))
+                  for name in ['cs_in', 'cs_out', 'os_in', 'os_out', 'ss_in', 'ss_out'])
+    os_last_leave = np.full((count, days), np.nan)
+    ss_last_leave = np.full((count, days), np.nan)
+    samples = []
+    cs_in = cs_out = os_voucher_out = ss_voucher_out = 0.
+    for minute in range(run_minutes):
+        clock = minute % 1440
+        in_window = start <= clock <= end
+        after_last_task_time = clock > last_task_time
+        created = lam[:, (minute // 60) % 24]
+        # crowd sourcing takes every cached task while working
+        cs_cache = cs_cache + created * p['create_cs']
+        cs_in = cs_in + created * p['create_cs']
+        cs_done = np.zeros(count)
+        if in_window:
+            slot = cs_work_minutes % cs_minutes
+            cs_done = cs_ring[slot].copy()
+            cs_ring[slot] = cs_cache
+            cs_cache = np.zeros(count)
+            cs_work_minutes += 1
+        cs_out = cs_out + cs_done
+        finished += cs_done * p['cs_finish']
+        # outer sourcing
+        os_stage.arrive(created * p['create_os'] + cs_done * (1 - p['cs_finish']) + os_returning,
+                        os_returning, in_window, after_last_task_time)
+        served, served_returned = os_stage.serve(in_window, extend_working)
+        served_new = served - served_returned
+        routed = served_new * p['os_voucher'] + served_returned
+        os_voucher_out = os_voucher_out + served_new * (1 - p['os_voucher'])
+        os_returning = served_new * (1 - p['os_voucher']) * p['os_voucher_os']
+        unfinished += served_new * (1 - p['os_voucher']) * (1 - p['os_voucher_os'])
+        finished += routed * (1 - p['os_finish_ss'])
+        os_leave = minute + p['os_process_time']
+        # self supporting
+        ss_stage.arrive(created * create_ss + routed * p['os_finish_ss'] + ss_returning,
+                        ss_returning, in_window, after_last_task_time)
+        ss_served, ss_served_returned = ss_stage.serve(in_window, extend_working)
+        ss_new = ss_served - ss_served_returned
+        finished += ss_new * p['ss_voucher'] + ss_served_returned
+        ss_voucher_out = ss_voucher_out + ss_new * (1 - p['ss_voucher'])
+        ss_returning = ss_new * (1 - p['ss_voucher']) * p['ss_voucher_ss']
+        unfinished += ss_new * (1 - p['ss_voucher']) * (1 - p['ss_voucher_ss'])
+        ss_leave = minute + p['ss_process_time']
+        # last finish time of each day
+        for last_leave, stage_served, leave in [(os_last_leave, served, os_leave),
+                                               (ss_last_leave, ss_served, ss_leave)]:
+            day = np.minimum((leave // 1440).astype(int), days - 1)
+            rows = np.nonzero(stage_served > EPS)[0]
+            last_leave[rows, day[rows]] = leave[rows] - day[rows] * 1440
+        # record curves
+        curves['cs_in'][minute] = cs_in
+        curves['cs_out'][minute] = cs_out
+        curves['os_in'][minute] = os_stage.arrived
+        curves['os_out'][minute] = os_stage.served
+        curves['ss_in'][minute] = ss_stage.arrived
+        curves['ss_out'][minute] = ss_stage.served
+        if minute % sample_interval == 0:
+            samples.append((cs_in - cs_out, os_stage.backlog, os_returning, ss_stage.backlog,
+                            ss_returning, finished.copy(), unfinished.copy(),
+                            cs_out, os_stage.served, os_voucher_out, ss_stage.served, ss_voucher_out))
+    curves = dict((name, np.ascontiguousarray(curve.T)) for name, curve in curves.items())
+    part = _fluid_aging(sim, p, curves, lam, create_ss, run_minutes, cohort_interval)
+    part.update(_fluid_work_time(os_last_leave, ss_last_leave))
+    sample = [np.stack(values, axis=1) for values in zip(*samples)]
+    part['backlog'] = dict(zip(FLUID_STAGES, sample[:7]))
+    part['throughput'] = dict(zip(FLUID_STAGES, sample[7:] + sample[5:7]))
+    return part
+
+
+def _fluid_aging(sim, p, curves, lam, create_ss, run_minutes, cohort_interval):
+    count = lam.shape[0]
+    # cohorts of tasks created within cohort_interval minutes, started at their middle
+    minutes = np.arange(0, run_minutes, cohort_interval)
+    created = lam[:, (minutes // 60) % 24] * cohort_interval
+    start = np.broadcast_to(minutes + (cohort_interval - 1) / 2, (count, len(minutes)))
+    col = lambda values: values[:, None]
+
+    def cs_exit(enter):
+        return _exit_minutes(curves['cs_in'], curves['cs_out'], enter, 0)
+
+    def os_exit(enter):
+        return _exit_minutes(curves['os_in'], curves['os_out'], enter, col(p['os_process_time']))
+
+    def ss_exit(enter):
+        return _exit_minutes(curves['ss_in'], curves['ss_out'], enter, col(p['ss_process_time']))
+
+    # leaves of the routing tree: (weight, finishing stage, finish minute)
+    leaves = []
+
+    def ss_tree(weight, enter):
+        first = ss_exit(enter)
+        leaves.append((weight * col(p['ss_voucher']), 'ss_processor', first))
+        second = ss_exit(first)
+        leaves.append((weight * col((1 - p['ss_voucher']) * p['ss_voucher_ss']), 'ss_processor', second))
+
+    def os_tree(weight, enter):
+        first = os_exit(enter)
+        second = os_exit(first)
+        for branch_weight, leave in [(col(p['os_voucher']), first),
+                                     (col((1 - p['os_voucher']) * p['os_voucher_os']), second)]:
+            leaves.append((weight * branch_weight * col(1 - p['os_finish_ss']), 'os_processor', leave))
+            ss_tree(weight * branch_weight * col(p['os_finish_ss']), leave)
+
+    cs_leave = cs_exit(start)
+    leaves.append((created * col(p['create_cs'] * p['cs_finish']), 'cs_processor', cs_leave))
+    os_tree(created * col(p['create_cs'] * (1 - p['cs_finish'])), cs_leave)
+    os_tree(created * col(p['create_os']), start)
+    ss_tree(created * col(create_ss), start)
+    total_weight = np.zeros(count)
+    total_time = np.zeros(count)
+    intime_weight = np.zeros(count)
+    # the fluid model is the default network
+    intime_condition = DEFAULT_NETWORK.intime_condition
+    system_time = DEFAULT_NETWORK.system_time
+    for weight, finish_type, leave in leaves:
+        done = np.isfinite(leave) & (leave < run_minutes)
+        weight = np.where(done, weight, 0)
+        hours = np.where(done, leave - start, 0) / 60
+        total_weight += weight.sum(axis=1)
+        total_time += (weight * (hours + system_time[finish_type])).sum(axis=1)
+        intime_weight += (weight * (hours < intime_condition[finish_type])).sum(axis=1)
+    total_weight = np.maximum(total_weight, EPS)
+    return {'mean_time': total_time / total_weight,
+            'completion_in24_rate': intime_weight / total_weight}
+
+
+def _fluid_work_time(os_last_leave, ss_last_leave):
+    # mirror Simulation.logging: one entry per day change, then reject the
+    # first two days and the last one
+    part = {'os_work_time': os_last_leave / 60, 'ss_work_time': ss_last_leave / 60}
+    columns = steady_days(os_last_leave.shape[1] - 1)
+    part['mean_os_work_time'] = np.nanmean(part['os_work_time'][:, columns], axis=1)
+    part['mean_ss_work_time'] = np.nanmean(part['ss_work_time'][:, columns], axis=1)
+    return part
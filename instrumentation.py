@@ -0,0 +1,110 @@
+
+import json
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+from event_trace import TRACE_ENTER
+from task import proxy_work
+
+
+class ProcessorStats(object):
+    """
+    counters of one processor, filled by Instrumentation
+    """
+    def __init__(self, name):
+        self.name = name
+        self.wall_time = 0.
+        self.wakeups = 0
+        self.tasks_entered = 0
+        self.tasks_left = 0
+
+    def report(self):
+        return OrderedDict([('wall_time', self.wall_time),
+                            ('wakeups', self.wakeups),
+                            ('tasks_entered', self.tasks_entered),
+                            ('tasks_left', self.tasks_left)])
+
+
+class Instrumentation(object):
+    """
+    opt-in profile of a simulation run: wall time and wake-ups of each
+    processor work loop, tasks moved through each processor, and wall time
+    and traced memory of the run and analysis phases. It takes the place of
+    the processors' trace, forwarding events to a real trace if there is one
+    """
+    def __init__(self, trace_memory=True, top_allocations=5):
+        self.trace_memory = trace_memory
+        self.top_allocations = top_allocations
+        self.processors = OrderedDict()
+        self.phases = OrderedDict()
+        self.trace = None
+        self.simulated_minutes = 0.
+        self._started_tracing = False
+
+    def stats(self, name):
+        stats = self.processors.get(name)
+        if stats is None:
+            stats = ProcessorStats(name)
+            self.processors[name] = stats
+        return stats
+
+    def record(self, task, taskbase, event, process_time=None):
+        stats = self.stats(taskbase.name)
+        if event == TRACE_ENTER:
+            stats.tasks_entered += 1
+        else:
+            stats.tasks_left += 1
+        if self.trace is not None:
+            self.trace.record(task, taskbase, event, process_time)
+
+    def work(self, processor):
+        # times every resumption of the processor's work generator
+        stats = self.stats(processor.name)
+
+        def resume(send, value):
+            start = time.perf_counter()
+            try:
+                event = send(value)
+            finally:
+                stats.wall_time += time.perf_counter() - start
+            stats.wakeups += 1
+            return event
+        return proxy_work(processor.work(), resume)
+
+    @contextmanager
+    def phase(self, name):
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = OrderedDict([('wall_time', time.perf_counter() - start)])
+            if self.trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                record['current_memory'] = current
+                record['peak_memory'] = peak
+                stats = tracemalloc.take_snapshot().statistics('lineno')[:self.top_allocations]
+                record['top_allocations'] = [[str(stat.traceback), stat.size, stat.count] for stat in stats]
+            self.phases[name] = record
+
+    def stop(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def report(self):
+        run_time = self.phases['run']['wall_time'] if 'run' in self.phases else 0.
+        return OrderedDict([
+            ('simulated_minutes', self.simulated_minutes),
+            ('simulated_minutes_per_second', self.simulated_minutes / run_time if run_time else None),
+            ('phases', self.phases),
+            ('processors', OrderedDict((name, stats.report()) for name, stats in self.processors.items()))])
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
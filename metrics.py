@@ -0,0 +1,269 @@
+
+import numpy as np
+import datetime as dt
+from utils import SIMULATION_START
+from schedule import MINUTES_PER_DAY
+
+# processors whose time is not counted in the task aging
+VOUCHER_PROCESSORS = ['ss_voucher_processor', 'os_voucher_processor']
+# hours within which a task finishing at a stage that sets none counts as completed in 24 hours
+INTIME_HOURS = 24.
+# hours of system time added to the aging of a task finishing at a stage that sets none
+SYSTEM_HOURS = 0.
+# number of first finished tasks rejected as warm-up
+REJECT_TASK_COUNT = 2
+# names of the values returned by Simulation.logging
+LOGGING_FIELDS = ['mean_time', 'completion_in24_rate', 'os_work_time', 'ss_work_time',
+                  'mean_os_work_time', 'mean_ss_work_time']
+# the scalar ones, the per-day work time lists are summarized by their means
+SCALAR_METRICS = ['mean_time', 'completion_in24_rate', 'mean_os_work_time', 'mean_ss_work_time']
+# the per-day lists of datetime.time
+TIME_LIST_FIELDS = ['os_work_time', 'ss_work_time']
+
+
+def steady_days(count, warm_up=True):
+    # entries kept of count per-day work times: the first two days are rejected
+    # as warm-up and the last one as unfinished, shorter runs keep every day.
+    # a run started warm has no warm-up days to reject
+    warm_up_days = 2 if warm_up else 0
+    if count > warm_up_days:
+        return slice(warm_up_days, count - 1)
+    return slice(0, count)
+
+
+def _steady_days(work_time, warm_up=True):
+    return work_time[steady_days(len(work_time), warm_up)]
+
+
+def _mean_hours(work_time):
+    # mean work time in hours, nan for a run without a whole day
+    if not work_time:
+        return np.nan
+    total = 0
+    for time in work_time:
+        total += time.hour + time.minute / 60
+    return round(total / len(work_time), 1)
+
+
+def summarize_work_time(os_work_time, ss_work_time, warm_up=True):
+    os_work_time = _steady_days(os_work_time, warm_up)
+    ss_work_time = _steady_days(ss_work_time, warm_up)
+    return os_work_time, ss_work_time, _mean_hours(os_work_time), _mean_hours(ss_work_time)
+
+
+def work_time_summary(work_times, warm_up=True):
+    # per-day work times kept and their mean, by work stage
+    summary = {}
+    for name, work_time in work_times.items():
+        work_time = _steady_days(work_time, warm_up)
+        summary[name] = (work_time, _mean_hours(work_time))
+    return summary
+
+
+def logging_values(mean_time, completion_in24_rate, work_times, warm_up=True):
+    """
+    the Simulation.logging tuple
+    :param work_times: per-day work times of each work stage in stage order, the
+                       first two fill the os and ss fields
+    :param warm_up: the run started empty, reject its warm-up days
+    """
+    stage_work_times = list(work_times.values())[:2]
+    stage_work_times += [[]] * (2 - len(stage_work_times))
+    os_work_time, ss_work_time, mean_os_work_time, mean_ss_work_time = summarize_work_time(*stage_work_times, warm_up=warm_up)
+    return mean_time, completion_in24_rate, os_work_time, ss_work_time, mean_os_work_time, mean_ss_work_time
+
+
+class StreamingMetrics(object):
+    """
+    online accumulator of the Simulation.logging metrics, fed one finished
+    task at a time so the tasks themselves need not be kept
+    """
+    def __init__(self, voucher_processor_name, intime_condition, system_time, work_stages):
+        """
+        :param intime_condition, system_time: hours by finishing stage, see Network
+        :param work_stages: stages whose last finish time of each day is kept
+        """
+        self.voucher_processor_name = voucher_processor_name
+        self.intime_condition = intime_condition
+        self.system_time = system_time
+        self.work_stages = list(work_stages)
+        self.task_count = 0
+        # aging of the rejected first tasks, used only if no other task finishes
+        self._rejected = []
+        self.total_time = dt.timedelta(0)
+        self.intime_count = 0
+        # finishing stage: [current day, last finish time, work time of each day]
+        self._work_time = dict((name, [None, None, []]) for name in self.work_stages)
+
+    def add(self, task):
+        time = task.time_consuming(self.voucher_processor_name)
+        stamp = task.time_stamps[-2]
+        finish_type = stamp.processor
+        self.task_count += 1
+        if self.task_count <= REJECT_TASK_COUNT:
+            self._rejected.append((time, finish_type))
+        else:
+            self._add_aging(time, finish_type)
+        # the last finish time of the stage on each day
+        if finish_type in self._work_time:
+            day_state = self._work_time[finish_type]
+            finish_time = stamp.time
+            if day_state[0] is None:
+                day_state[0] = finish_time.date()
+            elif finish_time.date() > day_state[0]:
+                day_state[0] = finish_time.date()
+                day_state[2].append(day_state[1].time())
+            day_state[1] = finish_time
+
+    def _add_aging(self, time, finish_type):
+        self.total_time = self.total_time + time + dt.timedelta(hours=self.system_time[finish_type])
+        self.intime_count += int(time < dt.timedelta(hours=self.intime_condition[finish_type]))
+
+    @property
+    def mean_time(self):
+        total_time, intime_count, count = self._aging_totals()
+        return round(total_time.total_seconds() / 3600 / count, 3)
+
+    @property
+    def completion_in24_rate(self):
+        total_time, intime_count, count = self._aging_totals()
+        return round(intime_count / count, 3)
+
+    def _aging_totals(self, warm_up=True):
+        if warm_up and self.task_count > REJECT_TASK_COUNT:
+            return self.total_time, self.intime_count, self.task_count - REJECT_TASK_COUNT
+        # the rejected first tasks count as well: too few tasks to reject any, or a run started warm
+        metrics = StreamingMetrics(self.voucher_processor_name, self.intime_condition, self.system_time,
+                                   self.work_stages)
+        for time, finish_type in self._rejected:
+            metrics._add_aging(time, finish_type)
+        return (self.total_time + metrics.total_time, self.intime_count + metrics.intime_count,
+                self.task_count)
+
+    def work_time(self, finish_type):
+        return list(self._work_time[finish_type][2])
+
+    def work_times(self):
+        return dict((name, self.work_time(name)) for name in self.work_stages)
+
+    def results(self, warm_up=True):
+        # warm_up: the run started empty, reject its first tasks and days
+        total_time, intime_count, count = self._aging_totals(warm_up)
+        mean_time = round(total_time.total_seconds() / 3600 / count, 3)
+        completion_in24_rate = round(intime_count / count, 3)
+        return logging_values(mean_time, completion_in24_rate, self.work_times(), warm_up)
+
+
+class ResultColumns(object):
+    """
+    finished tasks as numpy columns in finish order: aging in minutes without
+    the voucher time, id of the finishing stage and minute it was left
+    """
+    def __init__(self, aging, finish_processor, finish_minute, processor_names):
+        self.aging = aging
+        self.finish_processor = finish_processor
+        self.finish_minute = finish_minute
+        self.processor_names = processor_names
+
+    @classmethod
+    def from_stamps(cls, task, processor, time, processor_names, finished,
+                    voucher_processor_name=VOUCHER_PROCESSORS):
+        """
+        :param task, processor, time: one row per time stamp, the rows of a task in time order
+        :param processor_names: name of each processor id
+        :param finished: ids of the finished tasks in finish order
+        """
+        task = np.asarray(task)
+        time = np.asarray(time, dtype=np.float64)
+        finished = np.asarray(finished, dtype=task.dtype)
+        # group the rows of each task, keeping their order
+        order = np.argsort(task, kind='stable')
+        task_ids, starts, counts = np.unique(task[order], return_index=True, return_counts=True)
+        group = np.repeat(np.arange(len(task_ids)), counts)
+        sorted_time = time[order]
+        sorted_processor = np.asarray(processor)[order]
+        # voucher time: sum of (leave - enter) over complete voucher stamp pairs
+        voucher_ids = [processor_names.index(name) for name in voucher_processor_name
+                       if name in processor_names]
+        voucher_rows = np.nonzero(np.isin(sorted_processor, voucher_ids))[0]
+        voucher_group = group[voucher_rows]
+        voucher_count = np.bincount(voucher_group, minlength=len(task_ids))
+        rank = np.arange(len(voucher_rows)) - (np.cumsum(voucher_count) - voucher_count)[voucher_group]
+        paired = rank < voucher_count[voucher_group] // 2 * 2
+        signed_time = np.where(rank % 2 == 1, 1., -1.) * sorted_time[voucher_rows]
+        voucher_time = np.bincount(voucher_group[paired], weights=signed_time[paired],
+                                   minlength=len(task_ids))
+        # columns of the finished tasks
+        position = np.searchsorted(task_ids, finished)
+        first = starts[position]
+        last = first + counts[position] - 1
+        aging = sorted_time[last] - sorted_time[first] - voucher_time[position]
+        # timedelta resolution, as Task.time_consuming
+        aging = np.round(aging * 6e7) / 6e7
+        return cls(aging, sorted_processor[last - 1], sorted_time[last - 1], list(processor_names))
+
+    @property
+    def task_count(self):
+        return len(self.aging)
+
+    def _stage_lookup(self, table):
+        # per task value of a table keyed by finishing stage
+        lookup = np.zeros(len(self.processor_names))
+        for pid in np.unique(self.finish_processor):
+            lookup[pid] = table[self.processor_names[pid]]
+        return lookup[self.finish_processor]
+
+    def work_time(self, finish_type):
+        # last finish time of the stage on each day but the last one
+        if finish_type not in self.processor_names:
+            return []
+        minutes = self.finish_minute[self.finish_processor == self.processor_names.index(finish_type)]
+        day = np.floor(minutes / MINUTES_PER_DAY)
+        return [(SIMULATION_START + dt.timedelta(minutes=float(minute))).time()
+                for minute in minutes[np.nonzero(np.diff(day) > 0)[0]]]
+
+    def work_times(self, work_stages):
+        return dict((name, self.work_time(name)) for name in work_stages)
+
+    def results(self, intime_condition, system_time, work_stages, warm_up=True):
+        """
+        same values as Simulation.logging
+        :param intime_condition, system_time: hours by finishing stage, see Network
+        :param work_stages: stages whose work times are reported
+        :param warm_up: the run started empty, reject its first tasks and days
+        """
+        reject = warm_up and self.task_count > REJECT_TASK_COUNT
+        keep = slice(REJECT_TASK_COUNT, None) if reject else slice(None)
+        aging = self.aging[keep]
+        system_hours = self._stage_lookup(system_time)[keep]
+        intime_hours = self._stage_lookup(intime_condition)[keep]
+        mean_time = round(float(np.sum(aging / 60 + system_hours)) / len(aging), 3)
+        completion_in24_rate = round(float(np.count_nonzero(aging < intime_hours * 60)) / len(aging), 3)
+        return logging_values(mean_time, completion_in24_rate, self.work_times(work_stages), warm_up)
+
+
+class ColumnAccumulator(object):
+    """
+    accumulator of the ResultColumns of the finished tasks, one row appended
+    as each task finishes so logging only reduces the columns
+    """
+    def __init__(self, voucher_processor_name=VOUCHER_PROCESSORS):
+        self.voucher_processor_name = voucher_processor_name
+        self._processor_ids = {}
+        self.aging = []
+        self.finish_processor = []
+        self.finish_minute = []
+
+    def add(self, task):
+        time = task.time_consuming(self.voucher_processor_name)
+        stamp = task.time_stamps[-2]
+        self.aging.append(time.total_seconds() / 60)
+        self.finish_processor.append(self._processor_ids.setdefault(stamp.processor, len(self._processor_ids)))
+        self.finish_minute.append(stamp.minute)
+
+    def columns(self):
+        processor_names = sorted(self._processor_ids, key=self._processor_ids.get)
+        # timedelta resolution, as ResultColumns.from_stamps
+        aging = np.round(np.array(self.aging, dtype=np.float64) * 6e7) / 6e7
+        return ResultColumns(aging, np.array(self.finish_processor, dtype=np.int16),
+                             np.array(self.finish_minute, dtype=np.float64), processor_names)
@@ -0,0 +1,276 @@
+
+import re
+from task import TaskGenerator, TaskProcessor, InnerTaskProcessor, VoucherProcessor, ResultProcessor
+from metrics import StreamingMetrics, ColumnAccumulator, INTIME_HOURS, SYSTEM_HOURS
+
+# stage kind -> processor class
+STAGE_KINDS = {'generator': TaskGenerator, 'processor': TaskProcessor, 'inner': InnerTaskProcessor,
+               'voucher': VoucherProcessor, 'result': ResultProcessor}
+# stage kinds whose working hours and capability a schedule.Shifts can drive
+SHIFT_KINDS = ['processor', 'inner']
+# stage kinds whose last finish time of each day is reported as their work time
+WORK_KINDS = ['inner']
+# stage the finished tasks are logged from
+FINISHED_STAGE = 'finished tasks'
+_TERM = re.compile(r'\s*([+-]?)\s*([A-Za-z_]\w*|\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)')
+
+
+def param_value(spec, params):
+    """
+    value of a stage option: a number or any other value as is, or a string
+    naming a simulation attribute, or a sum of attributes and numbers such
+    as '1 - create_cs - create_os'
+    """
+    if not isinstance(spec, str):
+        return spec
+    terms = []
+    position = 0
+    while position < len(spec.rstrip()):
+        match = _TERM.match(spec, position)
+        if match is None:
+            raise ValueError('can not parse stage option {!r}'.format(spec))
+        terms.append(match.groups())
+        position = match.end()
+    values = []
+    for sign, term in terms:
+        if term[0].isdigit():
+            value = float(term)
+        elif hasattr(params, term):
+            value = getattr(params, term)
+        else:
+            raise AttributeError('simulation do not has attribution {}'.format(term))
+        values.append(-value if sign == '-' else value)
+    if len(terms) == 1 and not terms[0][0]:
+        return values[0]
+    return sum(values)
+
+
+def spec_params(spec):
+    # simulation attributes a stage option refers to
+    if not isinstance(spec, str):
+        return []
+    return [term for sign, term in _TERM.findall(spec) if not term[0].isdigit()]
+
+
+class Stage(object):
+    """
+    declarative stage of a network
+    :param name: processor name used in time stamps
+    :param kind: one of STAGE_KINDS
+    :param routes: name of the single next stage, or list of (stage name, weight)
+                   chosen from with one draw per task
+    :param voucher: (voucher stage name, ratio) of an inner stage
+    :param intime_hours: aging within which a task finishing at this stage counts
+                         as completed in 24 hours
+    :param system_hours: system time added to the aging of a task finishing here
+    :param options: other processor options, values as in param_value
+    """
+    def __init__(self, name, kind, routes=None, voucher=None, intime_hours=INTIME_HOURS,
+                 system_hours=SYSTEM_HOURS, **options):
+        if kind not in STAGE_KINDS:
+            raise ValueError('stage kind should be one of {}'.format(sorted(STAGE_KINDS)))
+        if voucher is not None and kind != 'inner':
+            raise ValueError('only inner stages have a voucher loop')
+        self.name = name
+        self.kind = kind
+        self.routes = routes
+        self.voucher = voucher
+        self.intime_hours = intime_hours
+        self.system_hours = system_hours
+        self.options = options
+
+    def route_names(self):
+        if self.routes is None:
+            return []
+        if isinstance(self.routes, str):
+            return [self.routes]
+        return [name for name, weight in self.routes]
+
+    def next_names(self):
+        # stages this stage hands tasks to, its voucher stage included
+        return self.route_names() + ([self.voucher[0]] if self.voucher else [])
+
+    def param_names(self):
+        # simulation attributes the processor and routes of this stage are built from
+        names = set()
+        for value in self.options.values():
+            names.update(spec_params(value))
+        if self.routes is not None and not isinstance(self.routes, str):
+            for name, weight in self.routes:
+                names.update(spec_params(weight))
+        if self.voucher:
+            names.update(spec_params(self.voucher[1]))
+        if 'tick' not in self.options:
+            names.add('tick')
+        return sorted(names)
+
+
+class RoutingTable(object):
+    """
+    routes of a network compiled to integer stage ids for one parameter set
+    """
+    def __init__(self, destinations, weights, direct, vouchers, voucher_ratios):
+        # per stage id: destination ids, their weights (None for a direct route),
+        # voucher stage id (-1 for none) and voucher ratio
+        self.destinations = destinations
+        self.weights = weights
+        self.direct = direct
+        self.vouchers = vouchers
+        self.voucher_ratios = voucher_ratios
+
+
+class Network(object):
+    """
+    workflow of stages, built into the processors of a Simulation; the
+    stage order is the order the processors are started in
+    :param params: extra simulation attributes the stages use, with their defaults
+    """
+    def __init__(self, name, stages, params=None):
+        self.name = name
+        self.stages = list(stages)
+        self.params = params or {}
+        self.stage_ids = {}
+        for stage_id, stage in enumerate(self.stages):
+            if stage.name in self.stage_ids:
+                raise ValueError('duplicated stage {}'.format(stage.name))
+            self.stage_ids[stage.name] = stage_id
+        generators = [stage for stage in self.stages if stage.kind == 'generator']
+        if len(generators) != 1:
+            raise ValueError('a network needs exactly one generator stage')
+        if FINISHED_STAGE not in self.stage_ids or self.stage(FINISHED_STAGE).kind != 'result':
+            raise ValueError('a network needs a result stage named {!r}'.format(FINISHED_STAGE))
+        for stage in self.stages:
+            for name in stage.next_names():
+                if name not in self.stage_ids:
+                    raise ValueError('stage {} routes to unknown stage {}'.format(stage.name, name))
+            if stage.voucher and self.stage(stage.voucher[0]).kind != 'voucher':
+                raise ValueError('voucher stage of {} is not a voucher stage'.format(stage.name))
+            if stage.kind != 'result' and stage.routes is None:
+                raise ValueError('stage {} has no routes'.format(stage.name))
+
+    def stage(self, name):
+        return self.stages[self.stage_ids[name]]
+
+    @property
+    def voucher_stages(self):
+        # stages whose time is not counted in the task aging
+        return [stage.name for stage in self.stages if stage.kind == 'voucher']
+
+    @property
+    def intime_condition(self):
+        # hours within which a task counts as completed in 24 hours, by finishing stage
+        return dict((stage.name, stage.intime_hours) for stage in self.stages)
+
+    @property
+    def system_time(self):
+        # hours of system time added to the task aging, by finishing stage
+        return dict((stage.name, stage.system_hours) for stage in self.stages)
+
+    @property
+    def work_stages(self):
+        # stages whose work time is reported, the first two in the os and ss fields of logging()
+        return [stage.name for stage in self.stages if stage.kind in WORK_KINDS]
+
+    def downstream_stages(self, params):
+        """
+        stages a change of any of the attributes params can change: the stages
+        built from them and every stage these lead to, in stage order
+        """
+        names = set(stage.name for stage in self.stages if set(stage.param_names()) & set(params))
+        pending = list(names)
+        while pending:
+            for name in self.stage(pending.pop()).next_names():
+                if name not in names:
+                    names.add(name)
+                    pending.append(name)
+        return [stage.name for stage in self.stages if stage.name in names]
+
+    def compile(self, params):
+        # routing table of the stages under the attributes of params
+        destinations = []
+        weights = []
+        direct = []
+        vouchers = []
+        voucher_ratios = []
+        for stage in self.stages:
+            destinations.append([self.stage_ids[name] for name in stage.route_names()])
+            direct.append(isinstance(stage.routes, str))
+            if stage.routes is None or isinstance(stage.routes, str):
+                weights.append(None)
+            else:
+                weights.append([param_value(weight, params) for name, weight in stage.routes])
+            if stage.voucher:
+                vouchers.append(self.stage_ids[stage.voucher[0]])
+                voucher_ratios.append(param_value(stage.voucher[1], params))
+            else:
+                vouchers.append(-1)
+                voucher_ratios.append(0)
+        return RoutingTable(destinations, weights, direct, vouchers, voucher_ratios)
+
+    def build(self, sim):
+        """
+        processors of the stages in stage order, wired by the routing table
+        """
+        for name in sim.shifts:
+            if name not in self.stage_ids:
+                raise ValueError('shifts of unknown stage {}'.format(name))
+        table = self.compile(sim)
+        processors = []
+        for stage in self.stages:
+            options = dict((name, param_value(value, sim)) for name, value in stage.options.items())
+            options.setdefault('tick', sim.tick)
+            if stage.name in sim.shifts:
+                if stage.kind not in SHIFT_KINDS:
+                    raise ValueError('only {} stages work in shifts'.format(' and '.join(SHIFT_KINDS)))
+                options['shifts'] = sim.shifts[stage.name]
+            if stage.kind == 'generator':
+                options['task_store'] = sim.task_store
+            else:
+                options['event_driven'] = sim.event_driven
+            if stage.kind == 'result':
+                # only the finished tasks are accumulated for logging
+                if stage.name == FINISHED_STAGE and sim.streaming_metrics:
+                    options['accumulator'] = StreamingMetrics(self.voucher_stages, self.intime_condition,
+                                                              self.system_time, self.work_stages)
+                elif stage.name == FINISHED_STAGE and sim.task_store is None:
+                    # a columnar store holds the columns already
+                    options['accumulator'] = ColumnAccumulator(self.voucher_stages)
+                options['keep_results'] = not sim.streaming_metrics
+            processors.append(STAGE_KINDS[stage.kind](sim.env, name=stage.name, **options))
+        for stage_id, processor in enumerate(processors):
+            processor.tick_order = stage_id
+            routes = [processors[i] for i in table.destinations[stage_id]]
+            if table.direct[stage_id]:
+                processor.set_routes(routes[0])
+            elif routes:
+                processor.set_routes(routes, table.weights[stage_id])
+            if table.vouchers[stage_id] >= 0:
+                processor.voucher_processor = processors[table.vouchers[stage_id]]
+                processor.voucher_ratio = table.voucher_ratios[stage_id]
+        return processors
+
+
+DEFAULT_NETWORK = Network('default', [
+    Stage('task_generator', 'generator', tick=1,
+          routes=[('cs_processor', 'create_cs'), ('os_processor', 'create_os'),
+                  ('ss_processor', '1 - create_cs - create_os')],  #自营流入众包、外包、自营占比
+          create_cnt='create_cnt', create_cancel='create_cancel'),
+    Stage('cs_processor', 'processor', start_time='start_time', end_time='end_time',
+          process_time='cs_process_time', intime_hours=23.5, system_hours=0.5,
+          routes=[('os_processor', '1 - cs_finish'), ('finished tasks', 'cs_finish')]),  #众包完结流入外包占比
+    Stage('os_processor', 'inner', capability='os_capability', start_time='start_time', end_time='end_time',
+          process_time='os_process_time', extend_working='extend_working', last_task_time='last_task_time',
+          intime_hours=20.2, system_hours=3.8,
+          routes=[('finished tasks', '1 - os_finish_ss'), ('ss_processor', 'os_finish_ss')],  #外包半智能完结比例
+          voucher=('os_voucher_processor', 'os_voucher')),  #外包补传凭证占比
+    Stage('os_voucher_processor', 'voucher', process_time_scale=1/2505,  #外包补传凭证平均时间分钟
+          routes=[('os_processor', 'os_voucher_os'), ('unfinished tasks', '1 - os_voucher_os')]),
+    Stage('ss_processor', 'inner', capability='ss_capability', start_time='start_time', end_time='end_time',
+          process_time='ss_process_time', extend_working='extend_working', last_task_time='last_task_time',
+          intime_hours=22.4, system_hours=1.6,
+          routes='finished tasks', voucher=('ss_voucher_processor', 'ss_voucher')),  #自营补传凭证比例
+    Stage('ss_voucher_processor', 'voucher', process_time_scale=1/1542,  #自营凭证补传平均时间分钟
+          routes=[('ss_processor', 'ss_voucher_ss'), ('unfinished tasks', '1 - ss_voucher_ss')]),
+    Stage('finished tasks', 'result'),
+    Stage('unfinished tasks', 'result'),
+])
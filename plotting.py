@@ -0,0 +1,35 @@
+import matplotlib.pyplot as plt
+from matplotlib.ticker import MultipleLocator, FormatStrFormatter
+
+def plot_graph(params, param_name, mean_time_l, completion_in24_rate_l,
+               mean_os_work_time_l, mean_ss_work_time_l, save_path):
+    plt.rcParams['font.sans-serif'] = ['Microsoft Yahei']
+
+    title = "{}变化影响".format(param_name)
+    xmajorLocator = MultipleLocator(1)  # 将x主刻度标签设置为1的倍数
+    xmajorFormatter = FormatStrFormatter('%1.1f')  # 设置x轴标签文本的格式
+
+    fig = plt.figure()
+    ax1 = fig.add_subplot(111)
+    ax1.plot(params, mean_time_l, label="平均时效")
+    ax1.plot(params, mean_ss_work_time_l, label='自营平均下班时间')
+    ax1.plot(params, mean_os_work_time_l, label='外包平均下班时间')
+    ax1.xaxis.set_major_locator(xmajorLocator)
+    ax1.set_xlabel('{}'.format(param_name), fontsize=14)
+    ax1.set_ylabel('时效/下班时间', fontsize=14)
+
+    ax1.set_xlim([params[0], params[-1]])
+    ax1.set_ylim([5, 26])
+    ax1.legend(loc=4)
+
+    ax2 = ax1.twinx()
+    ax2.plot(params, completion_in24_rate_l, ':', label='24小时履约率')
+    ax2.set_ylabel('24小时履约率', fontsize=14)
+    ax2.set_ylim([0.5, 1.1])
+    ax2.legend(loc=0)
+
+    ax1.grid(True)
+    #ax2.legend(loc=0)
+    plt.title(title, fontsize=18) #fontproperties="Microsoft Yahei"
+    plt.savefig(save_path)
+    plt.show()
@@ -0,0 +1,199 @@
+
+import bisect
+import math
+import zlib
+import numpy as np
+
+# engine random modes for variance reduction, see InversionStream
+VARIANCE_REDUCTION_MODES = [None, 'crn', 'antithetic']
+
+
+class LegacyRandom(object):
+    """
+    draws from the global numpy random state, one call per draw
+    """
+    def uniform(self):
+        return np.random.rand()
+
+    def exponential(self, scale):
+        return np.random.exponential(scale)
+
+    def poisson(self, lam):
+        return np.random.poisson(lam).__int__()
+
+    def uniforms(self, count):
+        return np.random.rand(count)
+
+    def poissons(self, lams):
+        # one draw for each rate of lams
+        return np.random.poisson(lams)
+
+
+GLOBAL_RANDOM = LegacyRandom()
+
+
+class RandomStream(object):
+    """
+    independent numpy Generator stream whose draws are made in blocks,
+    each distribution has its own child generator so the draws of one
+    do not shift the others
+    """
+    def __init__(self, seed_sequence, block_size=1024):
+        if not isinstance(seed_sequence, np.random.SeedSequence):
+            seed_sequence = np.random.SeedSequence(seed_sequence)
+        uniform_seed, exponential_seed, poisson_seed = seed_sequence.spawn(3)
+        self._uniform_gen = np.random.default_rng(uniform_seed)
+        self._exponential_gen = np.random.default_rng(exponential_seed)
+        self._poisson_gen = np.random.default_rng(poisson_seed)
+        self.block_size = block_size
+        self._uniforms = []
+        self._uniform_pos = 0
+        self._exponentials = []
+        self._exponential_pos = 0
+        # lam -> [block, position]
+        self._poissons = {}
+
+    def uniform(self):
+        if self._uniform_pos >= len(self._uniforms):
+            self._uniforms = self._uniform_gen.random(self.block_size).tolist()
+            self._uniform_pos = 0
+        value = self._uniforms[self._uniform_pos]
+        self._uniform_pos += 1
+        return value
+
+    def exponential(self, scale):
+        if self._exponential_pos >= len(self._exponentials):
+            self._exponentials = self._exponential_gen.standard_exponential(self.block_size).tolist()
+            self._exponential_pos = 0
+        value = self._exponentials[self._exponential_pos]
+        self._exponential_pos += 1
+        return value * scale
+
+    def poisson(self, lam):
+        buffer = self._poissons.get(lam)
+        if buffer is None or buffer[1] >= len(buffer[0]):
+            buffer = [self._poisson_gen.poisson(lam, self.block_size).tolist(), 0]
+            self._poissons[lam] = buffer
+        value = buffer[0][buffer[1]]
+        buffer[1] += 1
+        return value
+
+    # the batched draws take the same values as as many single draws
+
+    def uniforms(self, count):
+        values = []
+        while len(values) < count:
+            if self._uniform_pos >= len(self._uniforms):
+                self._uniforms = self._uniform_gen.random(self.block_size).tolist()
+                self._uniform_pos = 0
+            end = min(self._uniform_pos + count - len(values), len(self._uniforms))
+            values.extend(self._uniforms[self._uniform_pos:end])
+            self._uniform_pos = end
+        return np.array(values)
+
+    def poissons(self, lams):
+        # one draw for each rate of lams, in order as the blocks of the rates
+        # share one generator
+        return np.array([self.poisson(lam) for lam in np.asarray(lams).tolist()], dtype=np.int64)
+
+
+class InversionStream(object):
+    """
+    stream drawing every variate by inverting its cdf at one uniform from a
+    dedicated child generator, so runs with the same seed stay coupled when
+    a distribution parameter changes (common random numbers), and the
+    antithetic stream of a seed uses 1 - u for every uniform
+    """
+    def __init__(self, seed_sequence, block_size=1024, antithetic=False):
+        if not isinstance(seed_sequence, np.random.SeedSequence):
+            seed_sequence = np.random.SeedSequence(seed_sequence)
+        self.block_size = block_size
+        self.antithetic = antithetic
+        # kind -> [child generator, block, position]
+        self._buffers = dict((kind, [np.random.default_rng(child), [], 0]) for kind, child in
+                             zip(['uniform', 'exponential', 'poisson'], seed_sequence.spawn(3)))
+        # lam -> cdf table
+        self._poisson_cdfs = {}
+
+    def _refill(self, buffer):
+        values = buffer[0].random(self.block_size)
+        if self.antithetic:
+            # keep the values in [0, 1) as the generator does
+            values = np.minimum(1 - values, np.nextafter(1, 0))
+        buffer[1] = values.tolist()
+        buffer[2] = 0
+
+    def _next_uniform(self, kind):
+        buffer = self._buffers[kind]
+        if buffer[2] >= len(buffer[1]):
+            self._refill(buffer)
+        value = buffer[1][buffer[2]]
+        buffer[2] += 1
+        return value
+
+    def _next_uniforms(self, kind, count):
+        buffer = self._buffers[kind]
+        values = []
+        while len(values) < count:
+            if buffer[2] >= len(buffer[1]):
+                self._refill(buffer)
+            end = min(buffer[2] + count - len(values), len(buffer[1]))
+            values.extend(buffer[1][buffer[2]:end])
+            buffer[2] = end
+        return np.array(values)
+
+    def uniform(self):
+        return self._next_uniform('uniform')
+
+    def uniforms(self, count):
+        return self._next_uniforms('uniform', count)
+
+    def exponential(self, scale):
+        return -math.log1p(-self._next_uniform('exponential')) * scale
+
+    def _cdf(self, lam):
+        cdf = self._poisson_cdfs.get(lam)
+        if cdf is None:
+            cdf = poisson_cdf(lam)
+            self._poisson_cdfs[lam] = cdf
+        return cdf
+
+    def poisson(self, lam):
+        cdf = self._cdf(lam)
+        return min(bisect.bisect_right(cdf, self._next_uniform('poisson')), len(cdf) - 1)
+
+    def poissons(self, lams):
+        # one draw for each rate of lams, inverting the uniforms in order
+        lams = np.asarray(lams)
+        uniforms = self._next_uniforms('poisson', len(lams))
+        values = np.zeros(len(lams), dtype=np.int64)
+        for lam in np.unique(lams):
+            rows = np.nonzero(lams == lam)[0]
+            cdf = self._cdf(lam.item())
+            values[rows] = np.minimum(np.searchsorted(cdf, uniforms[rows], side='right'), len(cdf) - 1)
+        return values
+
+
+def poisson_cdf(lam):
+    # cdf of the poisson distribution up to where its tail is negligible
+    count = int(lam + 12 * math.sqrt(lam) + 20)
+    k = np.arange(count)
+    log_factorial = np.concatenate([[0.], np.cumsum(np.log(k[1:]))])
+    log_pmf = k * math.log(lam) - lam - log_factorial if lam > 0 else np.where(k == 0, 0., -np.inf)
+    return np.cumsum(np.exp(log_pmf)).tolist()
+
+
+def processor_stream(seed, name, block_size=1024, variance_reduction=None):
+    """
+    the stream of a processor depends only on the seed and its name,
+    so adding or changing other processors does not perturb it
+    :param variance_reduction: None for a plain stream, 'crn' for an inversion
+                               stream and 'antithetic' for its antithetic twin
+    """
+    if variance_reduction not in VARIANCE_REDUCTION_MODES:
+        raise ValueError('variance reduction should be one of {}'.format(VARIANCE_REDUCTION_MODES))
+    key = zlib.crc32(name.encode('utf-8'))
+    seed_sequence = np.random.SeedSequence(seed, spawn_key=(key,))
+    if variance_reduction is None:
+        return RandomStream(seed_sequence, block_size)
+    return InversionStream(seed_sequence, block_size, variance_reduction == 'antithetic')
@@ -0,0 +1,130 @@
+
+import datetime as dt
+import hashlib
+import json
+import os
+import sqlite3
+import numpy as np
+from simulation import SIMULATION_ATTRS, ENGINE_VERSION
+from network import DEFAULT_NETWORK
+from metrics import LOGGING_FIELDS, TIME_LIST_FIELDS
+
+CACHE_PATH = os.path.join('results', 'cache.sqlite')
+# engine options that change the result of a seeded run
+RESULT_OPTIONS = ['event_driven', 'random_seed', 'variance_reduction']
+
+
+def _param_value(value):
+    # simulation attribute -> value stored in sqlite
+    if isinstance(value, dt.time):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+class ResultCache(object):
+    """
+    sqlite store of logging() results keyed by a hash of every simulation
+    attribute, the seed, the result changing engine options and the engine
+    version, one column per attribute so slices can be queried
+    """
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        # workers of a process pool share the file, so wait for their locks
+        self.connection = sqlite3.connect(path, timeout=60)
+        columns = ['key TEXT PRIMARY KEY', 'engine_version TEXT', 'seed INTEGER', 'options TEXT'] + \
+                  SIMULATION_ATTRS + ['{} {}'.format(field, 'TEXT' if field in TIME_LIST_FIELDS else 'REAL')
+                                      for field in LOGGING_FIELDS] + ['created TEXT']
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS results ({})'.format(', '.join(columns)))
+
+    def close(self):
+        self.connection.close()
+
+    @staticmethod
+    def options(sim, warm_state=None):
+        options = dict((name, _param_value(getattr(sim, name))) for name in RESULT_OPTIONS)
+        if warm_state is not None:
+            options['warm_state'] = hashlib.sha1(warm_state.payload).hexdigest()
+        if sim.shifts:
+            options['shifts'] = dict((name, shifts.describe()) for name, shifts in sim.shifts.items())
+        if sim.network.name != DEFAULT_NETWORK.name:
+            options['network'] = sim.network.name
+            options.update((name, _param_value(getattr(sim, name))) for name in sim.network.params)
+        if sim.event_driven and sim.flow_upstream() is not None:
+            # event driven runs replaying an upstream flow may order the wake-ups of one time differently
+            options['flow_upstream'] = sim.flow_upstream()
+        return options
+
+    @staticmethod
+    def key(sim, seed, options):
+        content = {'attrs': dict((attr, _param_value(getattr(sim, attr))) for attr in SIMULATION_ATTRS),
+                   'seed': seed, 'options': options, 'engine_version': ENGINE_VERSION}
+        return hashlib.sha1(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        # the stored logging() result, None if the point was not run
+        row = self.connection.execute('SELECT {} FROM results WHERE key = ?'.format(', '.join(LOGGING_FIELDS)),
+                                      (key,)).fetchone()
+        if row is None:
+            return None
+        return tuple([dt.time.fromisoformat(time) for time in json.loads(value)]
+                     if field in TIME_LIST_FIELDS else value for field, value in zip(LOGGING_FIELDS, row))
+
+    def put(self, key, sim, seed, options, result):
+        values = [key, ENGINE_VERSION, seed, json.dumps(options, sort_keys=True)] + \
+                 [_param_value(getattr(sim, attr)) for attr in SIMULATION_ATTRS] + \
+                 [json.dumps([time.isoformat() for time in value]) if field in TIME_LIST_FIELDS
+                  else _param_value(value) for field, value in zip(LOGGING_FIELDS, result)] + \
+                 [dt.datetime.now().isoformat()]
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO results VALUES ({})'.format(', '.join(['?'] * len(values))),
+                                    values)
+
+    def _where(self, where):
+        # sql condition and arguments of a dict of column -> value or list of values
+        conditions = []
+        arguments = []
+        for name, value in (where or {}).items():
+            if name not in SIMULATION_ATTRS + ['seed', 'engine_version', 'options']:
+                raise AttributeError('result cache do not has column {}'.format(name))
+            if isinstance(value, (list, tuple, np.ndarray)):
+                conditions.append('{} IN ({})'.format(name, ', '.join(['?'] * len(value))))
+                arguments.extend(_param_value(v) for v in value)
+            else:
+                conditions.append('{} = ?'.format(name))
+                arguments.append(_param_value(value))
+        return (' WHERE ' + ' AND '.join(conditions)) if conditions else '', arguments
+
+    def query(self, columns, where=None):
+        """
+        :param columns: list of attribute, logging field or seed columns
+        :param where: dict of column -> value or list of values
+        :return: list of tuples of the columns
+        """
+        for name in columns:
+            if name not in SIMULATION_ATTRS + LOGGING_FIELDS + ['seed', 'engine_version', 'options']:
+                raise AttributeError('result cache do not has column {}'.format(name))
+        condition, arguments = self._where(where)
+        return self.connection.execute('SELECT {} FROM results{}'.format(', '.join(columns), condition),
+                                       arguments).fetchall()
+
+    def metric_slice(self, metric, param, where=None):
+        """
+        a metric against one parameter, averaged over the seeds of each value
+        :return: list of parameter values, list of means, list of run counts
+        """
+        if metric not in LOGGING_FIELDS or metric in TIME_LIST_FIELDS:
+            raise ValueError('{} is not a scalar metric'.format(metric))
+        if param not in SIMULATION_ATTRS:
+            raise AttributeError('simulation do not has attribution {}'.format(param))
+        condition, arguments = self._where(where)
+        rows = self.connection.execute('SELECT {0}, AVG({1}), COUNT(*) FROM results{2} GROUP BY {0} ORDER BY {0}'
+                                       .format(param, metric, condition), arguments).fetchall()
+        return [row[0] for row in rows], [row[1] for row in rows], [row[2] for row in rows]
@@ -0,0 +1,108 @@
+
+import datetime as dt
+import json
+import os
+import threading
+import numpy as np
+from metrics import LOGGING_FIELDS, TIME_LIST_FIELDS
+
+
+def _json_default(value):
+    if isinstance(value, (dt.time, dt.datetime, dt.date)):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError('{} is not json serializable'.format(type(value)))
+
+
+def point_record(params, seed, result, **extra):
+    """
+    :param params: simulation attributes of the run
+    :param result: logging() output
+    :param extra: more fields of the record
+    """
+    record = {'params': params, 'seed': seed}
+    record.update(zip(LOGGING_FIELDS, result))
+    record.update(extra)
+    return record
+
+
+def record_line(record):
+    return json.dumps(record, default=_json_default, ensure_ascii=False) + '\n'
+
+
+def parse_record(line):
+    # record of a json line, with work times parsed back to datetime.time
+    record = json.loads(line)
+    for field in TIME_LIST_FIELDS:
+        if field in record:
+            record[field] = [dt.time.fromisoformat(time) for time in record[field]]
+    return record
+
+
+class ResultWriter(object):
+    """
+    buffered json lines writer of one record per simulation run, shared by
+    the threads collecting the results of pool workers; each flush is one
+    write to a file opened for appending so separate processes appending
+    to the same file do not interleave their records
+    """
+    def __init__(self, path, buffer_records=256):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.buffer_records = buffer_records
+        self.record_count = 0
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def write(self, record):
+        line = record_line(record)
+        with self._lock:
+            self._buffer.append(line)
+            self.record_count += 1
+            if len(self._buffer) >= self.buffer_records:
+                self._flush()
+
+    def write_point(self, params, seed, result, **extra):
+        # see point_record
+        self.write(point_record(params, seed, result, **extra))
+
+    def _flush(self):
+        if self._buffer:
+            data = ''.join(self._buffer).encode('utf-8')
+            while data:
+                data = data[os.write(self._fd, data):]
+            self._buffer = []
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                self._flush()
+                os.close(self._fd)
+                self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_results(path):
+    # records of a json lines results file
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            records.append(parse_record(line))
+    return records
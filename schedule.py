@@ -0,0 +1,172 @@
+
+import datetime as dt
+import numpy as np
+from utils import SIMULATION_START
+
+MINUTES_PER_DAY = 1440
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+# weekdays, 0 is Monday
+WEEKDAYS = [0, 1, 2, 3, 4, 5, 6]
+WORKDAYS = [0, 1, 2, 3, 4]
+
+
+def minute_of_day(time):
+    # datetime.time -> minutes since midnight
+    return time.hour * 60 + time.minute + time.second / 60 + time.microsecond / 6e7
+
+
+class WorkCalendar(object):
+    """
+    working hours of a processor tabulated on its tick grid over one day,
+    answers whether it works at a minute and when that changes in O(1)
+    """
+    def __init__(self, start_time, end_time, tick, period=MINUTES_PER_DAY):
+        self.start_minute = minute_of_day(start_time)
+        self.end_minute = minute_of_day(end_time)
+        self.tick = tick
+        self.period = period
+        self._ticks = int(round(period / tick))
+        minutes = np.arange(self._ticks) * tick
+        self._tabulate((minutes >= self.start_minute) & (minutes <= self.end_minute))
+
+    def _tabulate(self, working, staff=None, on_break=None):
+        self._working = working.tolist()
+        self._staff = None if staff is None else staff.tolist()
+        self._on_break = None if on_break is None else on_break.tolist()
+        changes = working != np.roll(working, 1)
+        if staff is not None:
+            changes |= staff != np.roll(staff, 1)
+        self._ticks_to_change = self._ticks_to(changes)
+        self._ticks_to_start = self._ticks_to(working & ~np.roll(working, 1))
+
+    def _ticks_to(self, marks):
+        # ticks from each tick to the next marked one, strictly later, None if no mark
+        marked = np.nonzero(marks)[0]
+        if len(marked) == 0:
+            return [None] * self._ticks
+        index = np.arange(self._ticks)
+        later = np.searchsorted(marked, index, side='right')
+        target = np.where(later < len(marked), marked[np.minimum(later, len(marked) - 1)],
+                          marked[0] + self._ticks)
+        return (target - index).tolist()
+
+    def _index(self, minute):
+        return int(round(minute / self.tick)) % self._ticks
+
+    def is_working(self, minute):
+        return self._working[self._index(minute)]
+
+    def staff(self, minute):
+        # staff at work, None if the calendar leaves the capability to the processor
+        if self._staff is None:
+            return None
+        return self._staff[self._index(minute)]
+
+    def on_break(self, minute):
+        if self._on_break is None:
+            return False
+        return self._on_break[self._index(minute)]
+
+    def minutes_to_change(self, minute):
+        # minutes to the next tick at which the working state or the staff changes, None if never
+        ticks = self._ticks_to_change[self._index(minute)]
+        return None if ticks is None else ticks * self.tick
+
+    def minutes_to_start(self, minute):
+        # minutes to the next shift start, None if the processor always works
+        ticks = self._ticks_to_start[self._index(minute)]
+        return None if ticks is None else ticks * self.tick
+
+
+def _day_minutes(start_time, end_time):
+    # minutes since midnight of a span, the end past midnight if it is not after the start
+    start = minute_of_day(start_time)
+    end = minute_of_day(end_time)
+    return start, end if end > start else end + MINUTES_PER_DAY
+
+
+def hour_breaks(hours):
+    # one hour breaks starting at each hour, e.g. hour_breaks(utils.OMIT_TIME)
+    return [(dt.time(hour), dt.time((hour + 1) % 24)) for hour in hours]
+
+
+class Shifts(object):
+    """
+    weekly shift plan of a stage, tabulated on the tick grid of a processor
+    by calendar(tick); weekday 0 is Monday
+    :param shifts: list of (start_time, end_time) or (start_time, end_time, staff)
+                   worked on each of days, or dict weekday -> such a list; a shift
+                   includes its end tick as WorkCalendar does and runs past midnight
+                   if it does not end after it starts, the staff of overlapping
+                   shifts add up
+    :param days: weekdays a list of shifts is worked on
+    :param breaks: list of (start_time, end_time) without work on every day
+    """
+    def __init__(self, shifts, days=WEEKDAYS, breaks=None):
+        if not isinstance(shifts, dict):
+            shifts = dict((day, shifts) for day in days)
+        self.shifts = {}
+        for day, day_shifts in shifts.items():
+            if day not in WEEKDAYS:
+                raise ValueError('weekday should be one of {}'.format(WEEKDAYS))
+            self.shifts[day] = [tuple(shift) if len(shift) == 3 else tuple(shift) + (None,)
+                                for shift in day_shifts]
+        staffed = set(shift[2] is not None for day_shifts in self.shifts.values() for shift in day_shifts)
+        if len(staffed) > 1:
+            raise ValueError('staff should be given for every shift or for none')
+        self.staffed = staffed == {True}
+        self.breaks = list(breaks or [])
+
+    def describe(self):
+        # plain description of the plan, e.g. for a cache key
+        return {'shifts': dict((str(day), [[start.isoformat(), end.isoformat(), staff]
+                                           for start, end, staff in self.shifts[day]])
+                               for day in sorted(self.shifts)),
+                'breaks': [[start.isoformat(), end.isoformat()] for start, end in self.breaks]}
+
+    def calendar(self, tick):
+        return ShiftCalendar(self, tick)
+
+
+class ShiftCalendar(WorkCalendar):
+    """
+    WorkCalendar of a weekly shift plan, also answering the staff at work;
+    off shift the staff of the last shift stays on for overtime
+    """
+    def __init__(self, shifts, tick):
+        self.shifts = shifts
+        self.tick = tick
+        self.period = MINUTES_PER_WEEK
+        self._ticks = int(round(self.period / tick))
+        minutes = np.arange(self._ticks) * tick
+        # minutes of the week from the weekday of simulation time 0
+        week_minutes = (minutes + SIMULATION_START.weekday() * MINUTES_PER_DAY) % MINUTES_PER_WEEK
+        working = np.zeros(self._ticks, dtype=bool)
+        staff = np.zeros(self._ticks)
+        for day, day_shifts in shifts.shifts.items():
+            for start_time, end_time, shift_staff in day_shifts:
+                start, end = _day_minutes(start_time, end_time)
+                start += day * MINUTES_PER_DAY
+                end += day * MINUTES_PER_DAY
+                # a shift of sunday night ends on monday morning
+                on_shift = ((week_minutes >= start) & (week_minutes <= end)) | \
+                           (week_minutes <= end - MINUTES_PER_WEEK)
+                working |= on_shift
+                staff[on_shift] += shift_staff or 0
+        on_break = np.zeros(self._ticks, dtype=bool)
+        clock = week_minutes % MINUTES_PER_DAY
+        for start_time, end_time in shifts.breaks:
+            start, end = _day_minutes(start_time, end_time)
+            on_break |= ((clock >= start) & (clock < end)) | (clock < end - MINUTES_PER_DAY)
+        working &= ~on_break
+        if not shifts.staffed:
+            self._tabulate(working, on_break=on_break)
+            return
+        # carry the staff of each working tick over the following idle ticks
+        index = np.maximum.accumulate(np.where(working, np.arange(self._ticks), -1))
+        if working.any():
+            # the week wraps, so its first idle ticks carry its last shift
+            index[index < 0] = np.nonzero(working)[0][-1]
+        else:
+            index[:] = 0
+        self._tabulate(working, staff[index], on_break)
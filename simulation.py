@@ -1,13 +1,19 @@
 
 
-from task import TaskGenerator, TaskStack, TaskProcessor, VoucherType, \
-    InnerTaskProcessor, VoucherProcessor, ResultProcessor
+from task import TaskGenerator, InnerTaskProcessor
+from network import DEFAULT_NETWORK, FINISHED_STAGE
+from task_store import TaskStore
+from random_stream import processor_stream, VARIANCE_REDUCTION_MODES
+from event_trace import TraceWriter
+from instrumentation import Instrumentation
+from telemetry import Telemetry, TELEMETRY_INTERVAL
+from warm_state import WarmState
+from upstream_flow import FlowCut, flow_path, load_flow
+from metrics import ResultColumns, work_time_summary
 from simpy import Environment
 import numpy as np
 import datetime as dt
-import pandas as pd
 import time
-from utils import plot_graph
 import os
 
 SIMULATION_ATTRS = ['tick', 'start_time', 'end_time', 'last_task_time', 'ss_capability',
@@ -15,11 +21,59 @@ SIMULATION_ATTRS = ['tick', 'start_time', 'end_time', 'last_task_time', 'ss_capa
                  'run_time_days', 'extend_working', 'create_cnt', 'create_cancel', 'create_cs',
                  'create_os', 'create_ss', 'cs_finish', 'cs_os', 'os_voucher', 'os_voucher_os',
                  'os_finish_ss', 'ss_voucher', 'ss_voucher_ss']
+# bump when a change of the model changes the results of a seeded run
+ENGINE_VERSION = '6'
+# attribute -> stage of the default network
+DEFAULT_PROCESSORS = {'cs_proc': 'cs_processor', 'os_proc': 'os_processor',
+                      'os_voucher_proc': 'os_voucher_processor', 'ss_proc': 'ss_processor',
+                      'ss_voucher_proc': 'ss_voucher_processor', 'unfinished_proc': 'unfinished tasks'}
 
 class Simulation(object):
-    def __init__(self, save_path, show_logging=True, init_paras_from_text=True):
+    def __init__(self, save_path, show_logging=True, init_paras_from_text=True, event_driven=False,
+                 columnar_store=False, streaming_metrics=False, random_seed=None, trace_path=None,
+                 profile_path=None, variance_reduction=None, network=None, shifts=None,
+                 telemetry_interval=None, telemetry_path=None, flow_dir=None, flow_params=None):
         # create process environment
         self.env = Environment()
+        # stages and routes of the workflow, see network.Network
+        self.network = network or DEFAULT_NETWORK
+        # stage name -> schedule.Shifts, replacing start_time and end_time of that stage
+        self.shifts = shifts or {}
+        # schedule task completions instead of polling working tasks every tick
+        self.event_driven = event_driven
+        # keep task time stamps in a columnar task store
+        self.columnar_store = columnar_store
+        # accumulate logging metrics as tasks finish instead of keeping them
+        self.streaming_metrics = streaming_metrics
+        # seed of the per processor random streams, None draws from np.random
+        self.random_seed = random_seed
+        # 'crn' draws by inversion so runs with the same seed stay coupled across
+        # parameters, 'antithetic' gives the antithetic twin of such a run
+        if variance_reduction not in VARIANCE_REDUCTION_MODES:
+            raise ValueError('variance reduction should be one of {}'.format(VARIANCE_REDUCTION_MODES))
+        if variance_reduction is not None and random_seed is None:
+            raise ValueError('variance reduction needs a random seed')
+        self.variance_reduction = variance_reduction
+        # file to record every task event to, see event_trace.load_trace
+        self.trace_path = trace_path
+        # file to dump the instrumentation report of each run to, None runs uninstrumented
+        self.profile_path = profile_path
+        # minutes between telemetry samples of the queues of every processor, None records none
+        if telemetry_path is not None and telemetry_interval is None:
+            telemetry_interval = TELEMETRY_INTERVAL
+        self.telemetry_interval = telemetry_interval
+        # file to save the telemetry of each run to, see telemetry.load_telemetry
+        self.telemetry_path = telemetry_path
+        self.telemetry = None
+        # directory of recorded upstream flows, runs varying only flow_params
+        # replay the flow of the stages these do not reach, see upstream_flow
+        if flow_dir is not None and random_seed is None:
+            raise ValueError('upstream flows need a random seed')
+        if flow_dir is not None and columnar_store:
+            raise ValueError('upstream flows do not support the columnar store')
+        self.flow_dir = flow_dir
+        self.flow_params = list(flow_params or [])
+        self.flow_cut = None
         # define paras
         if init_paras_from_text:
             self.__init_paras_from_text()
@@ -47,9 +101,16 @@ class Simulation(object):
             self.os_finish_ss = 0.59 # 外包完结_自营
             self.ss_voucher = 0.16 # 自营_凭证
             self.ss_voucher_ss = 0.91 # 自营凭证_返回
+        # parameters only the stages of a custom network use
+        for name, value in self.network.params.items():
+            if not hasattr(self, name):
+                self.__setattr__(name, value)
 
         self.run_time_hours = 0  # 模拟小时数
         self.run_time_minutes = 0  # 模拟分钟数
+        # state the network is built from, None starts it empty
+        self._warm_state = None
+        self._restore_random = True
         # create processors
         self.processors = {}
         self._create_processors()
@@ -58,80 +119,74 @@ class Simulation(object):
         self.show_logging = show_logging
 
     def set_param(self, name, value):
-        if hasattr(self, name):
-            self.__setattr__(name, value)
+        self.set_params(**{name: value})
+
+    def set_params(self, **params):
+        for name, value in params.items():
+            if hasattr(self, name):
+                self.__setattr__(name, value)
+            else:
+                raise AttributeError('simulation do not has this attribution')
+        self._build()
+
+    def _build(self):
+        # rebuild the network, from the restored warm state if there is one
+        if self._warm_state is None:
             self.env = Environment()
             self._create_processors()
         else:
-            raise AttributeError('simulation do not has this attribution')
+            self.env = Environment(initial_time=self._warm_state.now)
+            self._create_processors()
+            self._warm_state.check(self)
+            self._warm_state.apply(self, self._restore_random)
+
+    @property
+    def _reject_warm_up(self):
+        # the reported run includes its warm-up from empty, not so if restored without the results
+        return self._warm_state is None or self._warm_state.keep_results
+
+    def snapshot(self, keep_results=True):
+        # warm state of the network after run(), see restore
+        return WarmState.capture(self, keep_results)
+
+    def restore(self, warm_state, restore_random=True):
+        """
+        continue from a warm state, run() then simulates from its time to run_time,
+        parameters set before or after the restore apply to the resumed run
+        :param restore_random: also restore the random states, otherwise the run
+                               continues with the current ones
+        """
+        self._warm_state = warm_state
+        self._restore_random = restore_random
+        self._build()
 
     def _create_processors(self):
-        # create recorded data processor
-        self.finished_proc = ResultProcessor(self.env,
-                                             name='finished tasks',
-                                             tick=self.tick)
-        self.unfinished_proc = ResultProcessor(self.env,
-                                               name='unfinished tasks',
-                                               tick=self.tick)
-        # create self-support processor
-        self.ss_proc = InnerTaskProcessor(self.env,
-                                         name='ss_processor',
-                                         tick=self.tick,
-                                         capability=self.ss_capability,
-                                         start_time=self.start_time,
-                                         end_time=self.end_time,
-                                         process_time=self.ss_process_time,
-                                         down_processors=self.finished_proc,
-                                         voucher_ratio=self.ss_voucher,  #自营补传凭证比例
-                                         extend_working=self.extend_working,
-                                         last_task_time=self.last_task_time)
-        # create ss voucher processot
-        self.ss_voucher_proc = VoucherProcessor(self.env,
-                                                name='ss_voucher_processor',
-                                                tick=self.tick,
-                                                down_processors=[self.ss_proc, self.unfinished_proc],
-                                                downweights=[self.ss_voucher_ss, 1-self.ss_voucher_ss], #凭证返回比例
-                                                process_time_scale=1/1542) #自营凭证补传平均时间分钟
-        self.ss_proc.voucher_processor = self.ss_voucher_proc
-        # create outer sourcing processor
-        self.os_proc = InnerTaskProcessor(self.env,
-                                     name='os_processor',
-                                     tick=self.tick,
-                                     capability=self.os_capability,
-                                     start_time=self.start_time,
-                                     end_time=self.end_time,
-                                     process_time=self.os_process_time,
-                                     down_processors=[self.finished_proc, self.ss_proc],
-                                     downweights=[1-self.os_finish_ss, self.os_finish_ss], #外包半智能完结比例
-                                     voucher_processor=None,
-                                     voucher_ratio=self.os_voucher, #外包补传凭证占比
-                                     extend_working=self.extend_working,
-                                     last_task_time=self.last_task_time)
-        # create os voucher processor
-        self.os_voucher_proc = VoucherProcessor(self.env,
-                                           name='os_voucher_processor',
-                                           tick=self.tick,
-                                           down_processors=[self.os_proc, self.unfinished_proc],
-                                           downweights=[self.os_voucher_os, 1-self.os_voucher_os], #外包补传凭证的上传概率
-                                           process_time_scale=1/2505) #外包补传凭证平均时间分钟
-        self.os_proc.voucher_processor = self.os_voucher_proc
-        # create crowd sourcing processor
-        self.cs_proc = TaskProcessor(self.env,
-                                name='cs_processor',
-                                tick=self.tick,
-                                start_time=self.start_time,
-                                end_time=self.end_time,
-                                process_time=self.cs_process_time,
-                                down_processors=[self.os_proc, self.finished_proc],
-                                downweights=[1-self.cs_finish, self.cs_finish]) #众包完结流入外包占比
-        # create task generator
-        self.generator = TaskGenerator(self.env,
-                                  name='task_generator',
-                                  tick=1,
-                                  down_processors=[self.cs_proc, self.os_proc,self.ss_proc],
-                                  downweights=[self.create_cs, self.create_os,1-self.create_cs-self.create_os],#自营流入众包、外包、自营占比
-                                  create_cnt=self.create_cnt,# 创建量
-                                  create_cancel = self.create_cancel)#创建后直接取消比例
+        # create columnar store of task time stamps
+        self.task_store = TaskStore() if self.columnar_store else None
+        # create the processors of the network in stage order
+        processor_list = self.network.build(self)
+        self.processors = dict((processor.name, processor) for processor in processor_list)
+        self._processor_list = processor_list
+        # short names of the processors of the default network
+        for attr, name in DEFAULT_PROCESSORS.items():
+            if name in self.processors:
+                self.__setattr__(attr, self.processors[name])
+        self.generator = [processor for processor in processor_list if isinstance(processor, TaskGenerator)][0]
+        self.finished_proc = self.processors[FINISHED_STAGE]
+        # profile of the next run
+        self.instrumentation = Instrumentation() if self.profile_path is not None else None
+        # give every processor its own random stream
+        if self.random_seed is not None:
+            for processor in self.processor_list:
+                processor.random = processor_stream(self.random_seed, processor.name,
+                                                    variance_reduction=self.variance_reduction)
+                if isinstance(processor, InnerTaskProcessor):
+                    processor.voucher_random = processor_stream(self.random_seed, processor.name + ' voucher',
+                                                                variance_reduction=self.variance_reduction)
+
+    @property
+    def processor_list(self):
+        return self._processor_list
 
     def __init_paras_from_text(self):
         # read setting
@@ -156,67 +211,118 @@ class Simulation(object):
 
     def run(self):
         # ----------------- Run Process ----------------- #
+        # record task events if asked
+        trace = None
+        if self.trace_path is not None:
+            trace = TraceWriter(self.trace_path, metadata={attr: str(getattr(self, attr))
+                                                           for attr in SIMULATION_ATTRS})
+        # sample the queues from now to the end of the run
+        if self.telemetry_interval is not None:
+            self.telemetry = Telemetry(self.processor_list, self.telemetry_interval,
+                                       int((self.run_time - self.env.now) / self.telemetry_interval) + 1)
+            self.env.process(self.telemetry.work())
+        instrumentation = self.instrumentation
+        if instrumentation is not None:
+            # the instrumentation counts task events and passes them to the trace
+            instrumentation.trace = trace
+        # replay the upstream flow if it was recorded, otherwise record it
+        self.flow_cut = flow_cut = self._flow_cut()
         # create process
-        self.env.process(self.generator.work())
-        self.env.process(self.cs_proc.work())
-        self.env.process(self.os_proc.work())
-        self.env.process(self.os_voucher_proc.work())
-        self.env.process(self.ss_proc.work())
-        self.env.process(self.ss_voucher_proc.work())
-        self.env.process(self.finished_proc.work())
-        self.env.process(self.unfinished_proc.work())
+        for processor in self.processor_list:
+            processor.trace = trace if instrumentation is None else instrumentation
+            if flow_cut is not None and not flow_cut.simulates(processor):
+                continue
+            work = processor.work() if instrumentation is None else instrumentation.work(processor)
+            if flow_cut is not None:
+                work = flow_cut.work(processor, work)
+            self.env.process(work)
+        if flow_cut is not None and not flow_cut.recording:
+            self.env.process(flow_cut.replay())
         # run
-        self.env.run(until=self.run_time)
+        if instrumentation is None:
+            self.env.run(until=self.run_time)
+        else:
+            with instrumentation.phase('run'):
+                self.env.run(until=self.run_time)
+            instrumentation.simulated_minutes = self.env.now
+            if self.profile_path is not None:
+                instrumentation.dump(self.profile_path)
+        if flow_cut is not None:
+            flow_cut.finish()
+        if trace is not None:
+            trace.close()
+        if self.telemetry_path is not None:
+            self.telemetry.save(self.telemetry_path)
+
+    def flow_upstream(self):
+        # stages whose flow a run varying flow_params replays, None if it runs every stage
+        if self.flow_dir is None or not self.flow_params:
+            return None
+        downstream = self.network.downstream_stages(self.flow_params)
+        upstream = [stage.name for stage in self.network.stages if stage.name not in downstream]
+        if not upstream or FINISHED_STAGE not in downstream:
+            return None
+        return upstream
+
+    def _flow_cut(self):
+        # recorder of the upstream flow of this run, or its replay once recorded
+        upstream = self.flow_upstream()
+        if upstream is None:
+            return None
+        if self._warm_state is not None:
+            raise ValueError('upstream flows can not be replayed from a warm state')
+        # everything the upstream stages depend on
+        attrs = set()
+        for name in upstream:
+            attrs.update(self.network.stage(name).param_names())
+        content = {'engine_version': ENGINE_VERSION, 'network': self.network.name, 'upstream': upstream,
+                   'run_time': self.run_time, 'event_driven': self.event_driven,
+                   'random_seed': self.random_seed, 'variance_reduction': self.variance_reduction,
+                   'attrs': dict((name, getattr(self, name)) for name in attrs),
+                   'shifts': dict((name, self.shifts[name].describe()) for name in upstream
+                                  if name in self.shifts)}
+        path = flow_path(self.flow_dir, content)
+        flow = load_flow(path) if os.path.exists(path) else None
+        return FlowCut(self.processor_list, upstream, flow, path)
 
     def logging(self):
-        # get result task stack
-        res_taskstack = self.finished_proc.result_stack
-        # get each task type and time consuming
-        time_list = []
-        type_list = []
-        for task in res_taskstack:
-            time_list.append(task.time_consuming(['ss_voucher_processor', 'os_voucher_processor']))
-            type_list.append(task.time_stamps[-2].processor)
-        # reject the first two
-        if len(time_list) > 2:
-            time_list = time_list[2:]
-            type_list = type_list[2:]
-        # compute mean time consuming & completion rate in time
-        total_time = dt.timedelta(0)
-        completion_in24_rate = 0
-        intime_condition = {'cs_processor': 23.5, 'os_processor' : 20.2, 'ss_processor' : 22.4}
-        system_time = {'cs_processor': 0.5, 'os_processor' : 3.8, 'ss_processor' : 1.6}
-        for time, finish_type in zip(time_list, type_list):
-            total_time = total_time + time + dt.timedelta(hours = system_time[finish_type])
-            completion_in24_rate += np.int(time < dt.timedelta(hours=intime_condition[finish_type]))
-        mean_time = round(total_time.total_seconds()/ 3600 / len(time_list), 3)
-        completion_in24_rate = round(completion_in24_rate / len(time_list), 3)
-        # get work time
-        os_res = TaskStack()
-        ss_res = TaskStack()
-        while not res_taskstack.is_empty:
-            task = res_taskstack.pop_task()
-            name = task.time_stamps[-2].processor
-            if name == 'os_processor':
-                os_res.add_task(task)
-            elif name == 'ss_processor':
-                ss_res.add_task(task)
-        os_work_time = self._get_work_time(os_res)
-        ss_work_time = self._get_work_time(ss_res)
-        # reject the first two
-        if len(os_work_time) > 2:
-            os_work_time = os_work_time[2:-1]
-            ss_work_time = ss_work_time[2:-1]
-        # compute mean work time
-        os_work_tt = 0
-        ss_work_tt = 0
-        for i in range(len(os_work_time)):
-            os_work_tt += os_work_time[i].hour + os_work_time[i].minute / 60
-            ss_work_tt += ss_work_time[i].hour + ss_work_time[i].minute / 60
-        mean_os_work_time = round(os_work_tt / len(os_work_time), 1)
-        mean_ss_work_time = round(ss_work_tt / len(ss_work_time), 1)
+        if self.instrumentation is None:
+            return self._logging()
+        with self.instrumentation.phase('logging'):
+            results = self._logging()
+        self.instrumentation.stop()
+        if self.profile_path is not None:
+            self.instrumentation.dump(self.profile_path)
+        return results
+
+    def _logging(self):
+        # metrics accumulated while the tasks finished
+        if self.streaming_metrics:
+            return self.finished_proc.accumulator.results(self._reject_warm_up)
+        network = self.network
+        return self.result_columns().results(network.intime_condition, network.system_time, network.work_stages,
+                                             self._reject_warm_up)
+
+    def work_times(self):
+        # per-day work times after the warm-up days and their mean in hours, by work stage of the network
+        if self.streaming_metrics:
+            work_times = self.finished_proc.accumulator.work_times()
+        else:
+            work_times = self.result_columns().work_times(self.network.work_stages)
+        return work_time_summary(work_times, self._reject_warm_up)
 
-        return mean_time, completion_in24_rate, os_work_time, ss_work_time, mean_os_work_time, mean_ss_work_time
+    def result_columns(self):
+        # columns of the finished tasks, the result stack is left as is
+        if self.streaming_metrics:
+            raise ValueError('finished tasks are not kept with streaming_metrics')
+        if self.task_store is None:
+            # appended as the tasks finished
+            return self.finished_proc.accumulator.columns()
+        store = self.task_store
+        rows = store.row_count
+        finished = [task.id for task in self.finished_proc.result_stack]
+        return ResultColumns.from_stamps(store.task[:rows], store.processor[:rows], store.time[:rows],
+                                         store.processor_names, finished, self.network.voucher_stages)
 
     def save_logging(self, name='', value=''):
         with open(self.save_path, 'a') as f:
@@ -231,17 +337,6 @@ class Simulation(object):
                 self.save_logging(attr, self.__getattribute__(attr))
         self.save_logging()
 
-    def _get_work_time(self, taskstack):
-        work_time = []
-        current_day = taskstack[0].time_stamps[-2].time.date()
-        for i in range(taskstack.task_count):
-            day = taskstack[i].time_stamps[-2].time.date()
-            if day > current_day:
-                current_day = day
-                work_time.append(taskstack[i - 1].time_stamps[-2].time.time())
-
-        return work_time
-
 def read_setting(setting_path='setting.txt'):
     # read text to parse setting
     attr_name = []
@@ -254,12 +349,9 @@ def read_setting(setting_path='setting.txt'):
     return attr_name, words
 
 if __name__ == '__main__':
+    from sweep_queue import SweepQueue, sweep_key
     # define paras
     bread_setting = True
-    mean_time_l = []
-    completion_in24_rate_l = []
-    mean_os_work_time_l = []
-    mean_ss_work_time_l = []
     os_capabilitys = np.arange(85, 90, 1)
     ss_capabilitys = np.arange(15, 20, 1)
 
@@ -281,44 +373,13 @@ if __name__ == '__main__':
     if not os.path.exists('results'):
         os.mkdir('results')
     save_path = os.path.join('results', save_path)
-    # create simulation
-    sim = Simulation(save_path + '.txt', init_paras_from_text=bread_setting)
-    # save params
-    sim.save_default_attr()
-    sim.save_logging('Adjustable Parameter', param_name)
-    sim.save_logging('Adjustable Range', params)
-    sim.save_logging()
-    # loop by params
-    for param in params:
-        # show param
-        sim.save_logging('current {}'.format(param_name), param)
-        # set param
-        sim.set_param(param_name, param)
-        # run
-        sim.run()
-        # get analysis information
-        mean_time, completion_in24_rate,os_work_time, ss_work_time, \
-        mean_os_work_time, mean_ss_work_time = sim.logging()
-        # save to list
-        mean_time_l.append(mean_time)
-        completion_in24_rate_l.append(completion_in24_rate)
-        mean_os_work_time_l.append(mean_os_work_time)
-        mean_ss_work_time_l.append(mean_ss_work_time)
-        # save logging
-        sim.save_logging('mean task aging', mean_time)
-        sim.save_logging('task completion rate in 24 hours', completion_in24_rate)
-        sim.save_logging('outer sourcing work time', os_work_time)
-        sim.save_logging('self supporting work time', ss_work_time)
-        sim.save_logging('mean outer sourcing work time', mean_os_work_time)
-        sim.save_logging('mean self supporting work time', mean_ss_work_time)
-        sim.save_logging()
-    # save list
-    sim.save_logging('list res')
-    sim.save_logging('mean task aging list', mean_time_l)
-    sim.save_logging('task completion rate list', completion_in24_rate_l)
-    sim.save_logging('mean outer sourcing work time list', mean_os_work_time_l)
-    sim.save_logging('mean self supporting work time list', mean_ss_work_time_l)
-    # plot
-    plot_graph(params, title_name, mean_time_l, completion_in24_rate_l,
-               mean_os_work_time_l, mean_ss_work_time_l, save_path + '.jpg')
-
+    # run every param from a queue that resumes after an interruption, workers on
+    # other hosts sharing results can join with python sweep_queue.py <queue dir>;
+    # the queue is named by a hash of every attribute, so a changed setting starts another
+    param_grid = {param_name: list(params)}
+    queue_dir = os.path.join('results', 'queue_{}_from{}to{}_{}'.format(
+        param_name, params[0], params[-1], sweep_key(param_grid, init_paras_from_text=bread_setting)))
+    queue = SweepQueue.create(queue_dir, param_grid, init_paras_from_text=bread_setting)
+    queue.work(processes=os.cpu_count())
+    # save the consolidated result and one json record per point
+    queue.collect(save_path, title_name, results_path=save_path + '.jsonl')
@@ -0,0 +1,207 @@
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import os
+import numpy as np
+from simulation import Simulation, SIMULATION_ATTRS
+from metrics import LOGGING_FIELDS
+from network import DEFAULT_NETWORK
+from fluid import fluid_run, VECTOR_ATTRS
+from sweep import point_seeds, confidence_interval, _run_point
+
+# whether a larger or a smaller value of a logging metric is better
+METRIC_GOALS = {'completion_in24_rate': 'max', 'mean_time': 'min',
+                'mean_os_work_time': 'min', 'mean_ss_work_time': 'min'}
+# distance of a screened metric from the target beyond which a value is not confirmed
+SCREEN_MARGINS = {'completion_in24_rate': 0.03, 'mean_time': 0.5,
+                  'mean_os_work_time': 0.5, 'mean_ss_work_time': 0.5}
+
+Evaluation = namedtuple('Evaluation', ['value', 'run_time_days', 'estimate', 'meets'])
+StaffingResult = namedtuple('StaffingResult', ['param', 'value', 'estimate', 'simulations',
+                                               'simulated_days', 'evaluations', 'screen'])
+
+
+class StaffingSearch(object):
+    """
+    search for the smallest value of an integer staffing parameter whose
+    metric meets a target, assuming the metric improves with staff: a fluid
+    run of every value, or a bisection on short single runs where the fluid
+    model does not apply, screens the answer, then replicated long runs on
+    common random numbers walk from it to the boundary, never down to a value
+    the screen puts clearly short of the target, so only the values near the
+    boundary are confirmed
+    """
+    def __init__(self, param, metric='completion_in24_rate', target=0.98, params=None,
+                 screen_days=5, confirm_days=15, confirm_replications=5, confidence=0.95,
+                 seed=0, init_paras_from_text=True, processes=None, fluid_screen=True,
+                 screen_margin=None, **sim_kwargs):
+        """
+        :param param: staffing attribute to search, e.g. 'ss_capability'
+        :param metric: logging metric compared to the target
+        :param params: other simulation attributes, fixed during the search
+        :param screen_days: days of the low fidelity runs used to bracket the answer
+        :param confirm_days: days of the replicated runs near the answer
+        :param confirm_replications: replications of the confirming runs, a value
+                                     meets the target if its whole confidence interval does
+        :param fluid_screen: screen with the fluid model if it models the runs
+        :param screen_margin: values screened further than this from meeting the target
+                              are taken to miss it, SCREEN_MARGINS by default
+        :param sim_kwargs: engine options passed to Simulation
+        """
+        if param not in SIMULATION_ATTRS:
+            raise AttributeError('simulation do not has attribution {}'.format(param))
+        if metric not in METRIC_GOALS:
+            raise ValueError('metric should be one of {}'.format(sorted(METRIC_GOALS)))
+        self.param = param
+        self.metric = metric
+        self.target = target
+        self.params = params or {}
+        self.screen_days = screen_days
+        self.confirm_days = confirm_days
+        self.confirm_replications = confirm_replications
+        self.confidence = confidence
+        self.init_paras_from_text = init_paras_from_text
+        self.processes = processes
+        self.fluid_screen = fluid_screen
+        self.screen_margin = SCREEN_MARGINS[metric] if screen_margin is None else screen_margin
+        # every candidate runs on the same coupled streams
+        self.seeds = point_seeds(seed, confirm_replications)
+        self.sim_kwargs = dict(sim_kwargs, random_streams=True)
+        self.sim_kwargs.setdefault('variance_reduction', 'crn')
+        self.simulations = 0
+        self.simulated_days = 0
+        # (value, run_time_days, replications) -> Evaluation
+        self.evaluations = {}
+        # value -> metric of the screen
+        self.screen_values = {}
+
+    def _meets(self, estimate, conservative):
+        # the whole confidence interval must meet the target in conservative mode
+        margin = estimate.half_width if conservative else 0
+        return self._meets_value(estimate.mean, margin)
+
+    def _meets_value(self, value, margin=0):
+        # whether value meets the target with margin to spare, nan never does
+        if METRIC_GOALS[self.metric] == 'max':
+            return value - margin >= self.target
+        return value + margin <= self.target
+
+    def _may_meet(self, value):
+        # values not screened, or screened close enough to the target, are confirmed
+        screened = self.screen_values.get(value)
+        return screened is None or np.isnan(screened) or self._meets_value(screened, -self.screen_margin)
+
+    @property
+    def fluid_applies(self):
+        # the fluid model is the default network on fixed working hours from an empty start
+        return (self.fluid_screen and self.param in VECTOR_ATTRS and
+                self.sim_kwargs.get('network', DEFAULT_NETWORK) is DEFAULT_NETWORK and
+                not self.sim_kwargs.get('shifts') and self.sim_kwargs.get('warm_state') is None)
+
+    def evaluate(self, value, run_time_days, replications):
+        key = (value, run_time_days, replications)
+        if key in self.evaluations:
+            return self.evaluations[key]
+        params = dict(self.params, run_time_days=run_time_days)
+        params[self.param] = value
+        args = [(params, s, self.init_paras_from_text, self.sim_kwargs) for s in self.seeds[:replications]]
+        if replications == 1 or self.processes == 1:
+            results = [_run_point(arg) for arg in args]
+        else:
+            with ProcessPoolExecutor(max_workers=self.processes) as pool:
+                results = list(pool.map(_run_point, args))
+        self.simulations += replications
+        self.simulated_days += replications * run_time_days
+        index = LOGGING_FIELDS.index(self.metric)
+        estimate = confidence_interval([result[index] for result in results], self.confidence)
+        evaluation = Evaluation(value, run_time_days, estimate, self._meets(estimate, replications > 1))
+        self.evaluations[key] = evaluation
+        return evaluation
+
+    def evaluate_fluid(self, low, high):
+        # metric of every value in [low, high] from one fluid run over the confirming days
+        sim = Simulation(os.devnull, show_logging=False, init_paras_from_text=self.init_paras_from_text)
+        sim.set_params(**dict(self.params, run_time_days=self.confirm_days))
+        values = np.arange(low, high + 1)
+        result = fluid_run(sim, **{self.param: values})
+        self.screen_values.update(zip(values.tolist(), getattr(result, self.metric).tolist()))
+
+    def screen(self, low, high):
+        # smallest value in [low, high] from which on every value may meet the
+        # target in the fluid run, or meets it on one short run by bisection
+        if self.fluid_applies:
+            self.evaluate_fluid(low, high)
+            if not self._may_meet(high):
+                return None
+            while high > low and self._may_meet(high - 1):
+                high -= 1
+            return high
+        if not self._screen_run(high):
+            return None
+        while low < high:
+            middle = (low + high) // 2
+            if self._screen_run(middle):
+                high = middle
+            else:
+                low = middle + 1
+        return high
+
+    def _screen_run(self, value):
+        evaluation = self.evaluate(value, self.screen_days, 1)
+        self.screen_values[value] = evaluation.estimate.mean
+        return evaluation.meets
+
+    def confirm(self, value, low, high):
+        # walk from the screened value to the smallest one meeting the target on the long runs
+        def meets(value):
+            return self.evaluate(value, self.confirm_days, self.confirm_replications).meets
+        if meets(value):
+            while value > low and self._may_meet(value - 1) and meets(value - 1):
+                value -= 1
+            return value
+        while value < high:
+            value += 1
+            if meets(value):
+                return value
+        return None
+
+    def search(self, low, high):
+        """
+        :param low, high: range of the staffing parameter searched
+        :return: StaffingResult, its value is None if even high misses the target
+        """
+        value = self.screen(low, high)
+        if value is not None:
+            value = self.confirm(value, low, high)
+        estimate = None
+        if value is not None:
+            estimate = self.evaluations[(value, self.confirm_days, self.confirm_replications)].estimate
+        evaluations = sorted(self.evaluations.values(), key=lambda e: (e.run_time_days, e.value))
+        return StaffingResult(self.param, value, estimate, self.simulations, self.simulated_days, evaluations,
+                              dict(self.screen_values))
+
+
+def minimum_staffing(param, low, high, metric='completion_in24_rate', target=0.98, **kwargs):
+    """
+    smallest value of param in [low, high] whose metric meets the target,
+    kwargs are the options of StaffingSearch
+    """
+    return StaffingSearch(param, metric, target, **kwargs).search(low, high)
+
+
+def staffing_frontier(param_a, values_a, param_b, low_b, high_b, metric='completion_in24_rate',
+                      target=0.98, params=None, **kwargs):
+    """
+    smallest param_b meeting the target for each value of param_a, more of one
+    staff never needs more of the other, so each search is bounded by the last
+    :return: list of (value of param_a, StaffingResult)
+    """
+    frontier = []
+    for value_a in sorted(values_a):
+        fixed = dict(params or {})
+        fixed[param_a] = value_a
+        result = StaffingSearch(param_b, metric, target, fixed, **kwargs).search(low_b, high_b)
+        frontier.append((value_a, result))
+        if result.value is not None:
+            high_b = result.value
+    return frontier
@@ -0,0 +1,330 @@
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import os
+import numpy as np
+from simulation import Simulation, SIMULATION_ATTRS
+from metrics import LOGGING_FIELDS, SCALAR_METRICS
+from result_cache import ResultCache
+from result_writer import ResultWriter
+
+SweepPoint = namedtuple('SweepPoint', ['params', 'seed', 'result'])
+MetricEstimate = namedtuple('MetricEstimate', ['mean', 'half_width', 'count'])
+
+
+def point_seeds(seed, count):
+    # independent deterministic seeds, one for each sweep point
+    return [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(count)]
+
+
+def telemetry_path(telemetry_dir, params, seed):
+    # telemetry file of one sweep run, named by its parameters and seed
+    # pool workers may create it at the same time
+    os.makedirs(telemetry_dir, exist_ok=True)
+    # no ':' of time values, file names can not hold it everywhere
+    name = '_'.join('{}={}'.format(attr, params[attr]).replace(':', '-') for attr in sorted(params))
+    return os.path.join(telemetry_dir, '{}_seed={}.npz'.format(name, seed))
+
+
+def run_point(params, seed, init_paras_from_text=True, sim_kwargs=None, attrs=None):
+    """
+    run one simulation with the given parameters and seed, return logging(),
+    the seed also seeds the per processor streams if sim_kwargs has random_streams,
+    the run resumes from sim_kwargs' warm_state with the point's own random state,
+    with a cache path in sim_kwargs' cache a point already stored is not run,
+    with a directory in sim_kwargs' telemetry_dir each run saves its telemetry there,
+    and with a directory in sim_kwargs' flow_dir the stages the point's parameters
+    do not reach are simulated once per seed and replayed from there
+    :param attrs: simulation attributes set before the point's parameters, they
+                  do not name the telemetry nor count as flow_params
+    """
+    np.random.seed(seed)
+    sim_kwargs = dict(sim_kwargs or {})
+    if sim_kwargs.pop('random_streams', False):
+        sim_kwargs['random_seed'] = seed
+    warm_state = sim_kwargs.pop('warm_state', None)
+    cache_path = sim_kwargs.pop('cache', None)
+    telemetry_dir = sim_kwargs.pop('telemetry_dir', None)
+    if telemetry_dir is not None:
+        sim_kwargs['telemetry_path'] = telemetry_path(telemetry_dir, params, seed)
+    if sim_kwargs.get('flow_dir') is not None:
+        sim_kwargs.setdefault('flow_params', sorted(params))
+    sim = Simulation(os.devnull, show_logging=False,
+                     init_paras_from_text=init_paras_from_text, **sim_kwargs)
+    if warm_state is not None:
+        sim.restore(warm_state, restore_random=False)
+    sim.set_params(**dict(attrs or {}, **params))
+    if cache_path is None:
+        sim.run()
+        return sim.logging()
+    cache = ResultCache(cache_path)
+    try:
+        options = cache.options(sim, warm_state)
+        key = cache.key(sim, seed, options)
+        result = cache.get(key)
+        if result is None:
+            sim.run()
+            result = sim.logging()
+            cache.put(key, sim, seed, options, result)
+        return result
+    finally:
+        cache.close()
+
+
+def warm_up(run_time_days, params=None, seed=0, init_paras_from_text=True, keep_results=False,
+            **sim_kwargs):
+    """
+    simulate the warm-up days once and return the warm state to pass to sweeps
+    as warm_state=, their run_time_days then includes the warm-up days
+    :param keep_results: keep the tasks finished during the warm-up in the results
+    """
+    np.random.seed(seed)
+    if sim_kwargs.pop('random_streams', False):
+        sim_kwargs['random_seed'] = seed
+    sim = Simulation(os.devnull, show_logging=False,
+                     init_paras_from_text=init_paras_from_text, **sim_kwargs)
+    sim.set_params(run_time_days=run_time_days, **(params or {}))
+    sim.run()
+    return sim.snapshot(keep_results)
+
+
+def simulation_attrs(init_paras_from_text=True, params=None):
+    # every simulation attribute of a run with the given parameters
+    sim = Simulation(os.devnull, show_logging=False, init_paras_from_text=init_paras_from_text)
+    attrs = dict((attr, getattr(sim, attr)) for attr in SIMULATION_ATTRS)
+    attrs.update(params or {})
+    return attrs
+
+
+def _run_point(args):
+    return run_point(*args)
+
+
+def grid_points(param_grid, seed=0, common_random_numbers=False):
+    # the points of a parameter grid in grid order and the seed of each
+    names = list(param_grid.keys())
+    for name in names:
+        if name not in SIMULATION_ATTRS:
+            raise AttributeError('simulation do not has attribution {}'.format(name))
+    points = [dict(zip(names, values))
+              for values in itertools.product(*[param_grid[name] for name in names])]
+    if common_random_numbers:
+        seeds = point_seeds(seed, 1) * len(points)
+    else:
+        seeds = point_seeds(seed, len(points))
+    return points, seeds
+
+
+def grid_sweep(param_grid, save_path=None, processes=None, seed=0,
+               init_paras_from_text=True, title_name=None, common_random_numbers=False,
+               results_path=None, **sim_kwargs):
+    """
+    run every point of a parameter grid in a process pool
+    :param param_grid: dict of simulation attribute name -> list of values
+    :param save_path: write results to save_path + '.txt' and the plot to save_path + '.jpg'
+    :param processes: number of worker processes, all cores by default
+    :param seed: seed from which each point's own seed is derived
+    :param common_random_numbers: run every point on the same coupled random streams,
+                                  so differences between points are not sampling noise
+    :param results_path: append one json record per point to this file as points finish
+    :param sim_kwargs: engine options passed to Simulation, random_streams=True seeds
+                       per processor random streams with the point's seed, warm_state=
+                       a WarmState from warm_up starts every point from it, cache= a
+                       ResultCache path skips the points stored in it, telemetry_dir=
+                       a directory keeps the queue telemetry of every run, flow_dir=
+                       a directory replays the stages the grid does not reach from
+                       one recorded run per seed, so it pays with the same seed at
+                       every point, as with common_random_numbers
+    :return: list(SweepPoint) in grid order
+    """
+    points, seeds = grid_points(param_grid, seed, common_random_numbers)
+    if common_random_numbers:
+        sim_kwargs = dict(sim_kwargs, random_streams=True)
+        sim_kwargs.setdefault('variance_reduction', 'crn')
+    args = [(params, s, init_paras_from_text, sim_kwargs) for params, s in zip(points, seeds)]
+    writer = ResultWriter(results_path) if results_path is not None else None
+    base_attrs = simulation_attrs(init_paras_from_text) if writer is not None else None
+    results = []
+    try:
+        if processes == 1:
+            results_iter = map(_run_point, args)
+            pool = None
+        else:
+            pool = ProcessPoolExecutor(max_workers=processes)
+            results_iter = pool.map(_run_point, args)
+        for (params, s, _, _), result in zip(args, results_iter):
+            results.append(result)
+            if writer is not None:
+                writer.write_point(dict(base_attrs, **params), s, result)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if writer is not None:
+            writer.close()
+    sweep_points = [SweepPoint(params, s, result) for params, s, result in zip(points, seeds, results)]
+    if save_path is not None:
+        save_sweep(sweep_points, param_grid, save_path, init_paras_from_text, title_name)
+    return sweep_points
+
+
+def sweep(param_name, params, save_path=None, processes=None, seed=0,
+          init_paras_from_text=True, title_name=None, **sim_kwargs):
+    """
+    run a sweep over one simulation attribute in a process pool
+    """
+    return grid_sweep({param_name: list(params)}, save_path, processes, seed,
+                      init_paras_from_text, title_name, **sim_kwargs)
+
+
+def save_sweep(sweep_points, param_grid, save_path, init_paras_from_text=True, title_name=None):
+    # write the consolidated results in the Simulation.save_logging format
+    sim = Simulation(save_path + '.txt', init_paras_from_text=init_paras_from_text)
+    names = list(param_grid.keys())
+    sim.save_default_attr()
+    sim.save_logging('Adjustable Parameter', ', '.join(names))
+    for name in names:
+        sim.save_logging('Adjustable Range', param_grid[name])
+    sim.save_logging()
+    mean_time_l = []
+    completion_in24_rate_l = []
+    mean_os_work_time_l = []
+    mean_ss_work_time_l = []
+    for point in sweep_points:
+        for name in names:
+            sim.save_logging('current {}'.format(name), point.params[name])
+        sim.save_logging('seed', point.seed)
+        mean_time, completion_in24_rate, os_work_time, ss_work_time, \
+        mean_os_work_time, mean_ss_work_time = point.result
+        mean_time_l.append(mean_time)
+        completion_in24_rate_l.append(completion_in24_rate)
+        mean_os_work_time_l.append(mean_os_work_time)
+        mean_ss_work_time_l.append(mean_ss_work_time)
+        sim.save_logging('mean task aging', mean_time)
+        sim.save_logging('task completion rate in 24 hours', completion_in24_rate)
+        sim.save_logging('outer sourcing work time', os_work_time)
+        sim.save_logging('self supporting work time', ss_work_time)
+        sim.save_logging('mean outer sourcing work time', mean_os_work_time)
+        sim.save_logging('mean self supporting work time', mean_ss_work_time)
+        sim.save_logging()
+    sim.save_logging('list res')
+    sim.save_logging('mean task aging list', mean_time_l)
+    sim.save_logging('task completion rate list', completion_in24_rate_l)
+    sim.save_logging('mean outer sourcing work time list', mean_os_work_time_l)
+    sim.save_logging('mean self supporting work time list', mean_ss_work_time_l)
+    # the graph shows one adjustable parameter, matplotlib is only loaded for it
+    if len(names) == 1:
+        from plotting import plot_graph
+        plot_graph(param_grid[names[0]], title_name or names[0], mean_time_l, completion_in24_rate_l,
+                   mean_os_work_time_l, mean_ss_work_time_l, save_path + '.jpg')
+
+
+def confidence_interval(values, confidence=0.95):
+    # mean and half width of the student t confidence interval
+    values = np.asarray(values, dtype=float)
+    count = len(values)
+    if count < 2:
+        return MetricEstimate(float(np.mean(values)) if count else np.nan, np.inf, count)
+    # scipy is only loaded by the process computing intervals, not by the workers
+    import scipy.stats as st
+    half_width = st.t.ppf((1 + confidence) / 2, count - 1) * np.std(values, ddof=1) / np.sqrt(count)
+    return MetricEstimate(float(np.mean(values)), float(half_width), count)
+
+
+def replicate(params=None, target_half_width=None, min_replications=3, max_replications=30,
+              confidence=0.95, processes=None, seed=0, init_paras_from_text=True, antithetic=False,
+              results_path=None, **sim_kwargs):
+    """
+    run independent seeded replications of one configuration in a process pool
+    :param params: dict of simulation attribute name -> value
+    :param target_half_width: stop once the confidence interval half width of every
+                              metric is below it, a number or dict of metric -> number
+    :param min_replications: replications run before checking the target
+    :param max_replications: upper bound of replications
+    :param confidence: confidence level of the intervals
+    :param processes: number of worker processes, replications run in batches of it
+    :param antithetic: every replication is the mean of a run and its antithetic twin
+    :param results_path: append one json record per run to this file
+    :return: dict of metric -> MetricEstimate, list(SweepPoint) of the runs
+    """
+    params = params or {}
+    for name in params:
+        if name not in SIMULATION_ATTRS:
+            raise AttributeError('simulation do not has attribution {}'.format(name))
+    if target_half_width is not None and not isinstance(target_half_width, dict):
+        target_half_width = dict((metric, target_half_width) for metric in SCALAR_METRICS)
+    processes = processes or os.cpu_count()
+    if antithetic:
+        sim_kwargs = dict(sim_kwargs, random_streams=True)
+        variants = [dict(sim_kwargs, variance_reduction=mode) for mode in ['crn', 'antithetic']]
+    else:
+        variants = [sim_kwargs]
+    seeds = point_seeds(seed, max_replications)
+    replications = []
+    writer = ResultWriter(results_path) if results_path is not None else None
+    attrs = simulation_attrs(init_paras_from_text, params) if writer is not None else None
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        while len(replications) < max_replications * len(variants):
+            # run up to the minimum first, then a batch of one run per worker
+            done = len(replications) // len(variants)
+            count = max(min_replications - done, processes // len(variants), 1)
+            batch_seeds = seeds[done:done + count]
+            args = [(params, s, init_paras_from_text, kwargs) for s in batch_seeds for kwargs in variants]
+            for arg, result in zip(args, pool.map(_run_point, args)):
+                replications.append(SweepPoint(params, arg[1], result))
+                if writer is not None:
+                    writer.write_point(attrs, arg[1], result,
+                                       variance_reduction=arg[3].get('variance_reduction'))
+            estimates = replication_estimates(replications, confidence, antithetic)
+            if target_half_width is not None and done + len(batch_seeds) >= min_replications and \
+                    all(estimates[metric].half_width <= width for metric, width in target_half_width.items()):
+                break
+    if writer is not None:
+        writer.close()
+    return replication_estimates(replications, confidence, antithetic), replications
+
+
+def compare_points(params_a, params_b, replications=10, confidence=0.95, processes=None, seed=0,
+                   init_paras_from_text=True, common_random_numbers=True, **sim_kwargs):
+    """
+    confidence intervals of the difference b - a of every scalar metric between two
+    configurations, with common random numbers each seed runs both on coupled streams
+    :return: dict of metric -> MetricEstimate of the difference, list of (a, b) SweepPoint pairs
+    """
+    for name in list(params_a) + list(params_b):
+        if name not in SIMULATION_ATTRS:
+            raise AttributeError('simulation do not has attribution {}'.format(name))
+    if common_random_numbers:
+        seeds = point_seeds(seed, replications)
+        seeds_a, seeds_b = seeds, seeds
+        sim_kwargs = dict(sim_kwargs, random_streams=True)
+        sim_kwargs.setdefault('variance_reduction', 'crn')
+    else:
+        seeds = point_seeds(seed, 2 * replications)
+        seeds_a, seeds_b = seeds[:replications], seeds[replications:]
+    args = [(params_a, s, init_paras_from_text, sim_kwargs) for s in seeds_a] + \
+           [(params_b, s, init_paras_from_text, sim_kwargs) for s in seeds_b]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        results = list(pool.map(_run_point, args))
+    pairs = [(SweepPoint(params_a, seed_a, result_a), SweepPoint(params_b, seed_b, result_b))
+             for seed_a, seed_b, result_a, result_b in
+             zip(seeds_a, seeds_b, results[:replications], results[replications:])]
+    estimates = {}
+    for metric in SCALAR_METRICS:
+        index = LOGGING_FIELDS.index(metric)
+        estimates[metric] = confidence_interval([b.result[index] - a.result[index] for a, b in pairs],
+                                                confidence)
+    return estimates, pairs
+
+
+def replication_estimates(replications, confidence=0.95, antithetic=False):
+    # confidence interval of every scalar logging metric over replications,
+    # antithetic runs come in pairs whose mean is one replication
+    estimates = {}
+    for metric in SCALAR_METRICS:
+        index = LOGGING_FIELDS.index(metric)
+        values = np.array([point.result[index] for point in replications], dtype=float)
+        if antithetic:
+            values = (values[0::2] + values[1::2]) / 2
+        estimates[metric] = confidence_interval(values, confidence)
+    return estimates
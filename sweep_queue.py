@@ -0,0 +1,305 @@
+
+import argparse
+import hashlib
+import os
+import pickle
+import socket
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from simulation import ENGINE_VERSION
+from metrics import LOGGING_FIELDS
+from result_writer import ResultWriter, point_record, record_line, parse_record
+from sweep import SweepPoint, grid_points, run_point, simulation_attrs, save_sweep
+
+QUEUE_FILE = 'queue.pkl'
+# seconds a claim is kept without being touched before other workers take it over
+LEASE_SECONDS = 900
+
+
+def _atomic_write(path, data):
+    # readers see the whole file or none of it
+    tmp_path = '{}.tmp.{}'.format(path, uuid.uuid4().hex)
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _keep_claim(claim_path, interval, stop):
+    # touch the claim until the point is done, so it is not taken over
+    while not stop.wait(interval):
+        try:
+            os.utime(claim_path)
+        except OSError:
+            return
+
+
+def _queue_config(param_grid, seed, init_paras_from_text, common_random_numbers, sim_kwargs):
+    points, seeds = grid_points(param_grid, seed, common_random_numbers)
+    if common_random_numbers:
+        sim_kwargs = dict(sim_kwargs, random_streams=True)
+        sim_kwargs.setdefault('variance_reduction', 'crn')
+    # every attribute is queued, so workers do not depend on their own setting.txt
+    attrs = simulation_attrs(init_paras_from_text)
+    return {'engine_version': ENGINE_VERSION,
+            'param_grid': param_grid,
+            'attrs': attrs,
+            'points': points,
+            'seeds': seeds,
+            'init_paras_from_text': init_paras_from_text,
+            'sim_kwargs': sim_kwargs}
+
+
+def _sweep_content(attrs, points, seeds, sim_kwargs):
+    # queues of equal content run the same sweep
+    return pickle.dumps([attrs, points, seeds, sim_kwargs])
+
+
+def sweep_key(param_grid, seed=0, init_paras_from_text=True, common_random_numbers=False, **sim_kwargs):
+    """
+    hash of everything the points of a sweep run with, to name its queue
+    directory, see SweepQueue.create for the arguments
+    """
+    config = _queue_config(param_grid, seed, init_paras_from_text, common_random_numbers, sim_kwargs)
+    content = _sweep_content(config['attrs'], config['points'], config['seeds'], config['sim_kwargs'])
+    return hashlib.sha1(content).hexdigest()[:12]
+
+
+class SweepQueue(object):
+    """
+    sweep backed by files in a directory shared by its workers, no server:
+    a worker claims a point by creating its claim file exclusively, keeps
+    it by touching the file while the point runs and finishes it by moving
+    its result file in place. Any number of workers on any host can join
+    or stop at any time, a stopped sweep resumes without running its done
+    points again, and claims left untouched for a lease are taken over
+    """
+    def __init__(self, queue_dir):
+        self.queue_dir = queue_dir
+        with open(os.path.join(queue_dir, QUEUE_FILE), 'rb') as f:
+            config = pickle.load(f)
+        if config['engine_version'] != ENGINE_VERSION:
+            raise ValueError('{} was created by engine version {}, this is {}'.format(
+                queue_dir, config['engine_version'], ENGINE_VERSION))
+        self.param_grid = config['param_grid']
+        # base attributes of every point and the grid parameters of each
+        self.attrs = config['attrs']
+        self.points = config['points']
+        self.seeds = config['seeds']
+        self.init_paras_from_text = config['init_paras_from_text']
+        self.sim_kwargs = config['sim_kwargs']
+        self._claims_dir = os.path.join(queue_dir, 'claims')
+        self._results_dir = os.path.join(queue_dir, 'results')
+        self._token = '{} {} {}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex)
+
+    @classmethod
+    def create(cls, queue_dir, param_grid, seed=0, init_paras_from_text=True, common_random_numbers=False,
+               **sim_kwargs):
+        """
+        queue the points of a parameter grid, or open the queue of the same sweep
+        if queue_dir holds one, see grid_sweep for the arguments
+        """
+        config = _queue_config(param_grid, seed, init_paras_from_text, common_random_numbers, sim_kwargs)
+        path = os.path.join(queue_dir, QUEUE_FILE)
+        if os.path.exists(path):
+            queue = cls(queue_dir)
+            if _sweep_content(queue.attrs, queue.points, queue.seeds, queue.sim_kwargs) != \
+                    _sweep_content(config['attrs'], config['points'], config['seeds'], config['sim_kwargs']):
+                raise ValueError('{} holds the queue of another sweep'.format(queue_dir))
+            return queue
+        for name in ['claims', 'results', 'clocks']:
+            os.makedirs(os.path.join(queue_dir, name), exist_ok=True)
+        _atomic_write(path, pickle.dumps(config, protocol=pickle.HIGHEST_PROTOCOL))
+        return cls(queue_dir)
+
+    def _claim_path(self, index):
+        return os.path.join(self._claims_dir, '{:06d}'.format(index))
+
+    def _result_path(self, index):
+        return os.path.join(self._results_dir, '{:06d}.json'.format(index))
+
+    def _storage_now(self):
+        # current time of the shared storage, as the claims are touched by other hosts' clocks
+        clock_path = os.path.join(self.queue_dir, 'clocks', uuid.uuid4().hex)
+        open(clock_path, 'w').close()
+        try:
+            return os.stat(clock_path).st_mtime
+        finally:
+            os.remove(clock_path)
+
+    def _create_claim(self, index):
+        try:
+            fd = os.open(self._claim_path(index), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return False
+        os.write(fd, self._token.encode('utf-8'))
+        os.close(fd)
+        # the point may have been finished by the worker whose claim just went away
+        if os.path.exists(self._result_path(index)):
+            self._release(index)
+            return False
+        return True
+
+    def _take_over(self, index, lease, now):
+        # remove the claim of a worker that stopped touching it, True if the point is free
+        claim_path = self._claim_path(index)
+        try:
+            age = now - os.stat(claim_path).st_mtime
+            with open(claim_path, 'r') as f:
+                token = f.read()
+        except FileNotFoundError:
+            return True
+        if age < lease:
+            return False
+        stale_path = '{}.stale.{}'.format(claim_path, uuid.uuid4().hex)
+        try:
+            os.rename(claim_path, stale_path)
+        except FileNotFoundError:
+            return False
+        with open(stale_path, 'r') as f:
+            moved = f.read()
+        if moved != token:
+            # another worker took the point over first, give its claim back
+            os.rename(stale_path, claim_path)
+            return False
+        os.remove(stale_path)
+        return True
+
+    def _claim(self, lease):
+        # index of a pending point claimed by this worker, None if no point is left
+        done = set(os.listdir(self._results_dir))
+        claimed = set(os.listdir(self._claims_dir))
+        now = self._storage_now()
+        for index in range(len(self.points)):
+            if os.path.basename(self._result_path(index)) in done:
+                continue
+            if os.path.basename(self._claim_path(index)) in claimed and not self._take_over(index, lease, now):
+                continue
+            if self._create_claim(index):
+                return index
+        return None
+
+    def _release(self, index):
+        try:
+            os.remove(self._claim_path(index))
+        except FileNotFoundError:
+            pass
+
+    def _run(self, index, lease):
+        stop = threading.Event()
+        keeper = threading.Thread(target=_keep_claim, args=(self._claim_path(index), lease / 4, stop))
+        keeper.daemon = True
+        keeper.start()
+        start = time.time()
+        try:
+            result = run_point(self.points[index], self.seeds[index], False, self.sim_kwargs, self.attrs)
+        except BaseException:
+            # leave the point to the next worker
+            stop.set()
+            self._release(index)
+            raise
+        stop.set()
+        params = dict(self.attrs, **self.points[index])
+        record = point_record(params, self.seeds[index], result, index=index,
+                              host=socket.gethostname(), seconds=time.time() - start)
+        _atomic_write(self._result_path(index), record_line(record).encode('utf-8'))
+        self._release(index)
+
+    def work(self, processes=1, lease=LEASE_SECONDS, max_points=None):
+        """
+        run pending points until none is left
+        :param processes: worker processes on this host
+        :param lease: seconds after which the claim of a worker that stopped is taken over
+        :param max_points: points run by each worker process at most
+        :return: number of points run on this host
+        """
+        if processes == 1:
+            count = 0
+            while max_points is None or count < max_points:
+                index = self._claim(lease)
+                if index is None:
+                    break
+                self._run(index, lease)
+                count += 1
+            return count
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            return sum(pool.map(_work_queue, [(self.queue_dir, lease, max_points)] * processes))
+
+    def status(self, lease=LEASE_SECONDS):
+        # point counts by state
+        done = set(os.listdir(self._results_dir))
+        claimed = set(os.listdir(self._claims_dir))
+        now = self._storage_now()
+        counts = {'done': 0, 'running': 0, 'stale': 0, 'pending': 0}
+        for index in range(len(self.points)):
+            claim_path = self._claim_path(index)
+            if os.path.basename(self._result_path(index)) in done:
+                counts['done'] += 1
+            elif os.path.basename(claim_path) in claimed:
+                try:
+                    stale = now - os.stat(claim_path).st_mtime >= lease
+                except FileNotFoundError:
+                    stale = False
+                counts['stale' if stale else 'running'] += 1
+            else:
+                counts['pending'] += 1
+        return counts
+
+    def results(self):
+        # dict of point index -> SweepPoint of the done points
+        points = {}
+        for name in os.listdir(self._results_dir):
+            if not name.endswith('.json'):
+                continue
+            with open(os.path.join(self._results_dir, name), 'r', encoding='utf-8') as f:
+                record = parse_record(f.read())
+            points[record['index']] = SweepPoint(self.points[record['index']], record['seed'],
+                                                 tuple(record[field] for field in LOGGING_FIELDS))
+        return points
+
+    def collect(self, save_path=None, title_name=None, results_path=None):
+        """
+        :param save_path: write the results as grid_sweep does
+        :param results_path: write one json record per point to this file
+        :return: list(SweepPoint) in grid order
+        """
+        results = self.results()
+        if len(results) < len(self.points):
+            raise ValueError('{} of {} points are not done'.format(len(self.points) - len(results),
+                                                                    len(self.points)))
+        sweep_points = [results[index] for index in range(len(self.points))]
+        if results_path is not None:
+            with ResultWriter(results_path) as writer:
+                for point in sweep_points:
+                    writer.write_point(dict(self.attrs, **point.params), point.seed, point.result)
+        if save_path is not None:
+            save_sweep(sweep_points, self.param_grid, save_path, self.init_paras_from_text, title_name)
+        return sweep_points
+
+
+def _work_queue(args):
+    queue_dir, lease, max_points = args
+    return SweepQueue(queue_dir).work(1, lease, max_points)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='worker of a sweep queue on shared storage')
+    parser.add_argument('queue_dir')
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--lease', type=float, default=LEASE_SECONDS,
+                        help='seconds after which a stopped worker\'s point is taken over')
+    parser.add_argument('--status', action='store_true', help='only print the point counts')
+    args = parser.parse_args(argv)
+    queue = SweepQueue(args.queue_dir)
+    if not args.status:
+        print('ran {} points'.format(queue.work(args.processes, args.lease)))
+    print(queue.status(args.lease))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
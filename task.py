@@ -1,20 +1,83 @@
 
 from simpy import Environment
 import numpy as np
+import heapq
+import bisect
+from collections import deque
 from enum import Enum
 import datetime as dt
-from utils import Task_Generation_Distribution, print_task
+from utils import Task_Generation_Distribution, print_task, PRINT_ID, SIMULATION_START
+from task_store import StoredTimeStamps
+from random_stream import GLOBAL_RANDOM
+from schedule import WorkCalendar, minute_of_day, MINUTES_PER_DAY
+from event_trace import TRACE_ENTER, TRACE_LEAVE
+
+# processor attributes holding random streams
+RANDOM_STATE = ('random', 'voucher_random')
+# processors take their turns at a time after its other events, in their
+# start order, however long they slept
+TURN_PRIORITY = 2
+
+def turn_event(env, order, delay=0):
+    # event processed in delay minutes after the other events of that time
+    # and the turns of a lower order
+    event = env.event()
+    event._ok = True
+    event._value = None
+    env.schedule(event, TURN_PRIORITY + order, delay)
+    return event
+
+def proxy_work(work, resume):
+    """
+    generator standing in for the work generator of a processor
+    :param resume: called as resume(send, value) to resume work, returns the
+                   next event work yields
+    """
+    send = work.send
+    value = None
+    while True:
+        try:
+            event = resume(send, value)
+        except StopIteration:
+            return
+        try:
+            value = yield event
+            send = work.send
+        except BaseException as error:
+            # hand interrupts on to the processor
+            value = error
+            send = work.throw
 
 class TaskTimeStamp(object):
+    __slots__ = ('processor', 'minute', 'process_time')
+
     def __init__(self, taskbase, process_time=None):
         assert isinstance(taskbase, TaskBase)
         self.processor = taskbase.name
-        self.time = taskbase.now
+        # simulation time in minutes
+        self.minute = taskbase.env.now
         if process_time is not None:
             self.process_time = process_time
         else:
             self.process_time = -1
 
+    @classmethod
+    def from_values(cls, processor, minute, process_time):
+        # time stamp of a recorded task, without the processor it was made by
+        stamp = cls.__new__(cls)
+        stamp.processor = processor
+        stamp.minute = minute
+        stamp.process_time = process_time
+        return stamp
+
+    @property
+    def clock_minute(self):
+        return self.minute % MINUTES_PER_DAY
+
+    @property
+    def time(self):
+        return SIMULATION_START + dt.timedelta(minutes=self.minute)
+
 class VoucherType(Enum):
     NOT_DETERMINED = 0
     LACKED = 1
@@ -22,12 +85,18 @@ class VoucherType(Enum):
     SUPPLEMENTARY = 3
 
 class Task(object):
-    def __init__(self, id):
+    __slots__ = ('id', 'task_type', 'time_stamps', '_process_time', '_processed_time',
+                 '_due_tick', 'voucher', 'index')
+
+    def __init__(self, id, index=None):
         self.id = id
+        # int id used by the event trace
+        self.index = index
         self.task_type = 0
         self.time_stamps = []
         self._process_time = 0
         self._processed_time = 0
+        self._due_tick = 0
         self.voucher = VoucherType.NOT_DETERMINED
 
     @property
@@ -45,31 +114,40 @@ class Task(object):
         # set process time in current processor
         self._process_time = process_time
         # create time stamp
-        self.time_stamps.append(TaskTimeStamp(taskbase, process_time))
+        self._add_time_stamp(taskbase, process_time)
+        if taskbase.trace is not None:
+            taskbase.trace.record(self, taskbase, TRACE_ENTER, process_time)
         # init processed time
         self._processed_time = 0
         # reset vouvher if needed
         if isinstance(taskbase, InnerTaskProcessor) and self.voucher == VoucherType.SUFFICIENT:
             self.voucher = VoucherType.NOT_DETERMINED
-        print_task(self.id, taskbase.name, taskbase.now.isoformat(), 'enter')
+        if PRINT_ID:
+            print_task('id_{}'.format(self.id), taskbase.name, taskbase.now.isoformat(), 'enter')
 
     def leave_processor(self, taskbase):
         # create time stamp
-        self.time_stamps.append(TaskTimeStamp(taskbase))
-        print_task(self.id, taskbase.name, taskbase.now.isoformat(), 'leave')
+        self._add_time_stamp(taskbase)
+        if taskbase.trace is not None:
+            taskbase.trace.record(self, taskbase, TRACE_LEAVE)
+        if PRINT_ID:
+            print_task('id_{}'.format(self.id), taskbase.name, taskbase.now.isoformat(), 'leave')
+
+    def _add_time_stamp(self, taskbase, process_time=None):
+        self.time_stamps.append(TaskTimeStamp(taskbase, process_time))
 
     def time_consuming(self, voucher_processor_name=None, with_voucher=False):
         # the time of task creation
-        start_time = self.time_stamps[0].time
+        start_time = self.time_stamps[0].minute
         # the time of task finish
-        end_time = self.time_stamps[-1].time
+        end_time = self.time_stamps[-1].minute
         # voucher time
         voucher_time_list = []
         for stamp in self.time_stamps:
             if stamp.processor in voucher_processor_name:
-                voucher_time_list.append(stamp.time)
-        voucher_time = dt.timedelta(0)
-        for i in range(np.int(len(voucher_time_list) / 2)):
+                voucher_time_list.append(stamp.minute)
+        voucher_time = 0
+        for i in range(int(len(voucher_time_list) / 2)):
             voucher_time += (voucher_time_list[2*i+1] - voucher_time_list[2*i])
         # time consuming
         if with_voucher:
@@ -77,9 +155,53 @@ class Task(object):
         else:
             time_consuming = end_time - start_time - voucher_time
 
-        return time_consuming
+        return dt.timedelta(minutes=time_consuming)
 
-class TaskStack(list):
+class StoredTask(Task):
+    """
+    task whose time stamps live in a columnar TaskStore, the id is an int
+    """
+    __slots__ = ('store', '_last_row', '_stamp_count')
+
+    def __init__(self, id, store):
+        self.id = id
+        self.index = id
+        self.task_type = 0
+        self.store = store
+        self._last_row = -1
+        self._stamp_count = 0
+        self._process_time = 0
+        self._processed_time = 0
+        self._due_tick = 0
+        self.voucher = VoucherType.NOT_DETERMINED
+
+    @property
+    def time_stamps(self):
+        return StoredTimeStamps(self.store, self._last_row, self._stamp_count)
+
+    def __getstate__(self):
+        # time_stamps is a view of the store, not state
+        return dict((name, getattr(self, name)) for name in Task.__slots__ + StoredTask.__slots__
+                    if name != 'time_stamps')
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def _add_time_stamp(self, taskbase, process_time=None):
+        if process_time is None:
+            process_time = -1
+        self._last_row = self.store.add_time_stamp(self.id, taskbase.name, taskbase.env.now,
+                                                   process_time, self._last_row)
+        self._stamp_count += 1
+
+    def time_consuming(self, voucher_processor_name=None, with_voucher=False):
+        return self.store.time_consuming(self._last_row, voucher_processor_name, with_voucher)
+
+class TaskStack(deque):
+    """
+    fifo queue of tasks with constant time pops from the front
+    """
 
     @property
     def task_count(self):
@@ -93,8 +215,72 @@ class TaskStack(list):
         assert isinstance(task, Task)
         self.append(task)
 
+    def add_tasks(self, tasks):
+        for task in tasks:
+            assert isinstance(task, Task)
+        self.extend(tasks)
+
     def pop_task(self):
-        return self.pop(0)
+        return self.popleft()
+
+    def pop_tasks(self, count=None):
+        # pop up to count tasks in fifo order, all tasks by default
+        if count is None or count >= self.task_count:
+            tasks = list(self)
+            self.clear()
+        else:
+            tasks = [self.popleft() for _ in range(count)]
+        return tasks
+
+    def move_tasks(self, taskstack, count=None):
+        # move up to count tasks to the end of another task stack
+        assert isinstance(taskstack, TaskStack)
+        tasks = self.pop_tasks(count)
+        taskstack.extend(tasks)
+        return len(tasks)
+
+class CompletionQueue(object):
+    """
+    working tasks of an event driven processor, ordered by the working tick
+    at which their processing finishes
+    """
+    def __init__(self):
+        self._heap = []
+        self._seq = 0
+
+    def __iter__(self):
+        return (entry[2] for entry in self._heap)
+
+    @property
+    def task_count(self):
+        return len(self._heap)
+
+    @property
+    def is_empty(self):
+        return True if self.task_count <= 0 else False
+
+    @property
+    def next_due_tick(self):
+        return self._heap[0][0] if self._heap else None
+
+    def add_task(self, task):
+        assert isinstance(task, Task)
+        # the sequence number keeps tasks finishing at the same tick in fifo order
+        heapq.heappush(self._heap, (task._due_tick, self._seq, task))
+        self._seq += 1
+
+    def pop_due_tasks(self, tick):
+        due_tasks = []
+        while self._heap and self._heap[0][0] <= tick:
+            due_tasks.append(heapq.heappop(self._heap)[2])
+        return due_tasks
+
+    def remove_tasks(self, condition):
+        removed = [entry[2] for entry in self._heap if condition(entry[2])]
+        if removed:
+            self._heap = [entry for entry in self._heap if not condition(entry[2])]
+            heapq.heapify(self._heap)
+        return removed
 
 class TaskBase(object):
     def __init__(self, env, name, tick):
@@ -102,18 +288,38 @@ class TaskBase(object):
         self.env = env
         self.name = name
         self.tick = tick
-        self._time = dt.datetime(2018, 1, 1)
+        # optional event_trace.TraceWriter shared by the simulation
+        self.trace = None
+        # position of the processor in the start order, set by the network
+        self.tick_order = 0
+
+    @property
+    def minute(self):
+        # every processor reads the simulation time of the shared environment
+        return self.env.now
+
+    @property
+    def clock_minute(self):
+        return self.env.now % MINUTES_PER_DAY
 
     @property
     def now(self):
-        return self._time
+        return SIMULATION_START + dt.timedelta(minutes=self.env.now)
 
     @property
     def clock_time(self):
-        return self._time.time()
+        return self.now.time()
 
-    def time_update(self, minute=1):
-        self._time += dt.timedelta(minutes=minute)
+    def _align_to_tick(self):
+        # minutes to the next point of the processor's tick grid
+        ticks = self.env.now / self.tick
+        if abs(ticks - round(ticks)) < 1e-9:
+            return 0
+        return np.ceil(ticks) * self.tick - self.env.now
+
+    def _turn(self, delay=0):
+        # after the turns of the processors started before this one
+        return turn_event(self.env, self.tick_order, delay)
 
 class TaskProcessor(TaskBase):
     def __init__(self, env, name,
@@ -123,7 +329,9 @@ class TaskProcessor(TaskBase):
                  end_time=dt.time(23, 59),
                  process_time=0,
                  down_processors=[],
-                 downweights=None):
+                 downweights=None,
+                 event_driven=False,
+                 shifts=None):
         """
         :param env: simpy enviroment
         :param name: processor name used in time stamp
@@ -134,46 +342,95 @@ class TaskProcessor(TaskBase):
         :param process_time: the process time for task in the processor
         :param down_processors: next stages for processed task
         :param downweights: list(number)
+        :param event_driven: schedule each task's completion when it enters instead of
+                             polling the working task stack every tick
+        :param shifts: schedule.Shifts driving working and capability instead of
+                       start_time and end_time
         """
         TaskBase.__init__(self, env, name, tick)
         self.capability = capability
         self.start_time = start_time
         self.end_time = end_time
+        self.shifts = shifts
+        if shifts is not None:
+            self.calendar = shifts.calendar(tick)
+        else:
+            self.calendar = WorkCalendar(start_time, end_time, tick)
         self.process_time = process_time
         # create taskstack link
+        self.cache_taskstack = TaskStack()
+        self.set_routes(down_processors, downweights)
+        # random stream of the processor, the global numpy random state by default
+        self.random = GLOBAL_RANDOM
+        # create working task stack
+        self.event_driven = event_driven
+        if event_driven:
+            self.working_taskstack = CompletionQueue()
+        else:
+            self.working_taskstack = TaskStack()
+        # working ticks elapsed, used as the clock of the completion queue
+        self._work_ticks = 0
+        # event used to wake a sleeping event driven processor
+        self._wakeup = None
+        # tick and working state of the last wake of an event driven processor
+        self._last_tick = None
+        self._last_working = False
+        # time of the last push that wakes the processor at its next tick
+        self._late_wake = None
+
+    def set_routes(self, down_processors, downweights=None):
+        """
+        compile the next stages into a destination list and cumulative weights
+        :param down_processors: one processor, taken by every task without a draw,
+                                or a list chosen from with one uniform draw per task
+        """
         if isinstance(down_processors, list):
             for processor in down_processors:
                 assert isinstance(processor, TaskProcessor)
+            self._routes = list(down_processors)
         else:
             assert isinstance(down_processors, TaskProcessor)
-        self.cache_taskstack = TaskStack()
+            self._routes = [down_processors]
+        self._direct = not isinstance(down_processors, list)
         self.down_processors = down_processors
         self.down_weights = downweights
-        # create working task stack
-        self.working_taskstack = TaskStack()
+        # cumulative routing weights, looked up with one uniform draw per task
+        if isinstance(down_processors, list) and downweights:
+            self._cum_weights = np.cumsum(downweights).tolist()
+        else:
+            self._cum_weights = None
+
+    def tap_routes(self, tap):
+        # replace every next stage by tap(stage), which takes the tasks handed to it
+        self._routes = [tap(processor) for processor in self._routes]
 
     @property
     def working(self):
-        return self.clock_time >= self.start_time and \
-               self.clock_time <= self.end_time
+        return self.calendar.is_working(self.env.now)
+
+    @property
+    def current_capability(self):
+        # staff of the shift at work, the fixed capability without shifts
+        staff = self.calendar.staff(self.env.now)
+        return self.capability if staff is None else staff
 
     @property
     def capable(self):
-        return self.working_taskstack.task_count < self.capability
+        return self.working_taskstack.task_count < self.current_capability
 
     def work(self):
+        if self.event_driven:
+            return self._event_work()
+        return self._tick_work()
+
+    def _tick_work(self):
         while True:
-            #if self.now.time() == self.start_time:
-            #    print('cache size in {} is {}'.format(self.name, self.cache_taskstack.task_count))
-            #if self.name == 'ns_processor':
-            #    print(self.now, self.cache_taskstack.task_count, self.working_taskstack.task_count)
             # run this work function evety 1 time unit
             # process in work time
             if self.working:
                 # push the completed task into next stage
                 if not self.working_taskstack.is_empty:
-                    for _ in range(self.working_taskstack.task_count):
-                        task = self.working_taskstack.pop_task()
+                    for task in self.working_taskstack.pop_tasks():
                         task.update_processed_time(self.tick)
                         if task.Processed:
                             task.leave_processor(self)
@@ -183,9 +440,109 @@ class TaskProcessor(TaskBase):
                 # get new task if processor is capable
                 while not self.cache_taskstack.is_empty and self.capable:
                     self._get_new_task()
+            else:
+                # nothing moves off shift, sleep to the next shift boundary
+                change = self.calendar.minutes_to_change(self.env.now)
+                if change is not None:
+                    yield self._turn(change)
+                    continue
             # update time
-            yield self.env.timeout(self.tick)
-            self.time_update(self.tick)
+            yield self._turn(self.tick)
+
+    def _event_work(self):
+        while True:
+            # tasks pushed by a processor with another tick wake us off the grid
+            delay = self._align_to_tick()
+            if delay > 0:
+                yield self.env.timeout(delay)
+            # work in the order of the tick engine
+            yield self._turn()
+            now_tick = int(round(self.env.now / self.tick))
+            last_tick = self._last_tick
+            if last_tick is None or now_tick > last_tick:
+                if last_tick is not None:
+                    # the working state is constant between wakes, so every
+                    # skipped tick is a working tick if we slept while working
+                    if self._last_working:
+                        self._work_ticks += now_tick - last_tick - 1
+                self._last_tick = now_tick
+                if self.working:
+                    self._work_ticks += 1
+                    self._finish_due_tasks()
+                    while not self.cache_taskstack.is_empty and self.capable:
+                        self._get_new_task()
+            elif self.working:
+                # woken again within the same tick by newly arrived tasks
+                while not self.cache_taskstack.is_empty and self.capable:
+                    self._get_new_task()
+            self._last_working = self.working
+            if not self._last_working:
+                # nothing is taken off shift, so arrivals need not wake us
+                change = self.calendar.minutes_to_change(self.env.now)
+                if change is not None:
+                    yield self.env.timeout(change)
+                    continue
+            # sleep until a task finishes, the shift changes or a task arrives
+            self._wakeup = self.env.event()
+            delay = self._next_wake_delay(self._last_working)
+            if delay is None:
+                yield self._wakeup
+            else:
+                yield self.env.timeout(delay) | self._wakeup
+            self._wakeup = None
+
+    def _finish_due_tasks(self):
+        for task in self.working_taskstack.pop_due_tasks(self._work_ticks):
+            task.leave_processor(self)
+            self._push_task_to_next_stage(task)
+
+    def _next_wake_delay(self, working):
+        delays = []
+        if working and not self.working_taskstack.is_empty:
+            delays.append((self.working_taskstack.next_due_tick - self._work_ticks) * self.tick)
+        if not self.working_taskstack.is_empty or not self.cache_taskstack.is_empty:
+            change = self.calendar.minutes_to_change(self.env.now)
+            if change is not None:
+                delays.append(change)
+        return min(delays) if delays else None
+
+    def get_state(self):
+        # queues, clocks and random stream, enough to resume work in a new environment
+        return {'cache_taskstack': self.cache_taskstack,
+                'working_taskstack': self.working_taskstack,
+                '_work_ticks': self._work_ticks,
+                '_last_tick': self._last_tick,
+                '_last_working': self._last_working,
+                'random': self.random}
+
+    def set_state(self, state, restore_random=True):
+        for name, value in state.items():
+            if restore_random or name not in RANDOM_STATE:
+                setattr(self, name, value)
+
+    def receive_task(self, task, sender=None):
+        self.cache_taskstack.add_task(task)
+        self._wake(sender)
+
+    def receive_tasks(self, tasks, sender=None):
+        self.cache_taskstack.add_tasks(tasks)
+        self._wake(sender)
+
+    def _wake(self, sender=None):
+        if self._wakeup is None or self._wakeup.triggered:
+            return
+        if sender is not None and sender.tick_order > self.tick_order and self._align_to_tick() == 0:
+            # by tick this processor has already worked when a processor started
+            # after it pushes, so the tasks wait for the next tick
+            if self._late_wake != self.env.now:
+                self._late_wake = self.env.now
+                self.env.timeout(self.tick).callbacks.append(self._late_wakeup)
+        else:
+            self._wakeup.succeed()
+
+    def _late_wakeup(self, event):
+        if self._wakeup is not None and not self._wakeup.triggered:
+            self._wakeup.succeed()
 
     def get_process_time(self):
         return self.process_time
@@ -193,9 +550,16 @@ class TaskProcessor(TaskBase):
     def _get_new_task(self):
         task = self.cache_taskstack.pop_task()
         task.enter_processor(self)
+        self._schedule_task(task)
         self._add_new_task(task)
         return task
 
+    def _schedule_task(self, task):
+        if self.event_driven:
+            # the first tick of processing is credited at the next working tick
+            ticks = np.ceil(task._process_time / self.tick).__int__()
+            task._due_tick = self._work_ticks + max(ticks, 1)
+
     def _add_new_task(self, task):
         self.working_taskstack.add_task(task)
 
@@ -203,61 +567,104 @@ class TaskProcessor(TaskBase):
         self._tradition_push(task)
 
     def _tradition_push(self, task):
-        # reset voucher to false when task go to next stage
-        if isinstance(self.down_processors, TaskProcessor):
-            self.down_processors.cache_taskstack.add_task(task)
+        if self._cum_weights is not None:
+            ind = bisect.bisect_right(self._cum_weights, self.random.uniform())
+            # guard against weights summing to slightly less than one
+            ind = min(ind, len(self._cum_weights) - 1)
+            self._routes[ind].receive_task(task, self)
+        elif self._direct:
+            self._routes[0].receive_task(task, self)
         else:
-            if self.down_weights:
-                weights = np.cumsum(np.array(self.down_weights))
-                rand_seed = np.random.rand(1)
-                ind = np.nonzero(rand_seed < weights)[0][0]
-                self.down_processors[ind].cache_taskstack.add_task(task)
-            else:
-                raise ValueError('down weights should not be None')
+            raise ValueError('down weights should not be None')
 
 class TaskGenerator(TaskProcessor):
     def __init__(self, env, name='task_generator', tick=1,
-                 down_processors=[], downweights=None, create_cnt=1e4, create_cancel=0.02):
+                 down_processors=[], downweights=None, create_cnt=1e4, create_cancel=0.02,
+                 task_store=None):
         TaskProcessor.__init__(self, env, name, tick,
                                down_processors=down_processors, downweights=downweights)
         self.task_count = 0
+        # keep time stamps in a columnar store instead of per task lists
+        self.task_store = task_store
         self.create_cnt_dist = create_cnt * Task_Generation_Distribution * (1 - create_cancel) / 60
+        # arrivals drawn up to midnight, released one tick at a time
+        self._plan = None
 
     def work(self):
         while True:
             # print rate of progress
-            if self.now.time() == dt.time(0,0):
+            if self.clock_minute == 0:
                 print('current simulation time is {}'.format(self.now.date()))
-            # generate new tasks
-            tasks = self._get_new_task()
-            for task in tasks:
-                task.leave_processor(self)
-                self._push_task_to_next_stage(task)
+            # release the new tasks of this tick
+            self._release_tasks()
             # update time
             yield self.env.timeout(self.tick)
-            self.time_update(self.tick)
 
-
-    @property
-    def next_task_num(self):
-        lam = self.create_cnt_dist[self.clock_time.hour]
-        return np.random.poisson(lam, size=1).__int__()
-
-    def _get_new_task(self):
+    def get_state(self):
+        state = TaskProcessor.get_state(self)
+        state['task_count'] = self.task_count
+        state['_plan'] = self._plan
+        return state
+
+    def set_state(self, state, restore_random=True):
+        TaskProcessor.set_state(self, state, restore_random)
+        # a plan drawn under other rates or weights is drawn again from now
+        if self._plan is not None and (self._plan['rates'] != self.create_cnt_dist.tolist() or
+                                       self._plan['weights'] != self._cum_weights):
+            self._plan = None
+
+    def _plan_day(self):
+        # the arrival count of every tick up to midnight and the first stage
+        # of every arrival, drawn in one go from the generator's stream
+        minute = self.clock_minute
+        ticks = max(int(round((MINUTES_PER_DAY - minute) / self.tick)), 1)
+        hours = ((minute + np.arange(ticks) * self.tick) // 60).astype(int)
+        counts = self.random.poissons(self.create_cnt_dist[hours])
+        total = int(np.sum(counts))
+        if self._cum_weights is not None:
+            routes = np.searchsorted(self._cum_weights, self.random.uniforms(total), side='right')
+            # guard against weights summing to slightly less than one
+            routes = np.minimum(routes, len(self._cum_weights) - 1)
+        elif self._direct:
+            routes = np.zeros(total, dtype=np.int64)
+        else:
+            raise ValueError('down weights should not be None')
+        self._plan = {'counts': counts.tolist(), 'routes': routes.tolist(), 'tick': 0, 'task': 0,
+                      'rates': self.create_cnt_dist.tolist(), 'weights': self._cum_weights}
+        return self._plan
+
+    def _release_tasks(self):
+        plan = self._plan
+        if plan is None or plan['tick'] >= len(plan['counts']):
+            plan = self._plan_day()
+        count = plan['counts'][plan['tick']]
+        plan['tick'] += 1
+        if count == 0:
+            return
+        routes = plan['routes'][plan['task']:plan['task'] + count]
+        plan['task'] += count
         # create new tasks
-        new_tasks = TaskStack()
-        for _ in range(self.next_task_num):
-            self.task_count += 1
-            id = 'id_{}'.format(self.task_count)
-            task = Task(id)
+        tasks = []
+        for task_id in range(self.task_count + 1, self.task_count + count + 1):
+            if self.task_store is not None:
+                task = StoredTask(task_id, self.task_store)
+            else:
+                task = Task(task_id, task_id)
             task.enter_processor(self)
-            new_tasks.add_task(task)
-        return new_tasks
-
-    def _add_new_task(self, task):
-        assert isinstance(task, TaskStack)
-        for _ in range(task.task_count):
-            self.working_taskstack.add_task(task.pop_task())
+            tasks.append(task)
+        self.task_count += count
+        # hand them to their first stages in batches, the stages in the order
+        # of their first task
+        batches = {}
+        for task, route in zip(tasks, routes):
+            task.leave_processor(self)
+            batch = batches.get(route)
+            if batch is None:
+                batches[route] = [task]
+            else:
+                batch.append(task)
+        for route, batch in batches.items():
+            self._routes[route].receive_tasks(batch, self)
 
 class InnerTaskProcessor(TaskProcessor):
     def __init__(self, env, name, tick=0.5, capability=np.Inf,
@@ -265,53 +672,88 @@ class InnerTaskProcessor(TaskProcessor):
                  process_time=0,
                  down_processors=[], downweights=None,
                  voucher_processor=None, voucher_ratio=0,
-                 extend_working=False, last_task_time=dt.time(18,0)):
+                 extend_working=False, last_task_time=dt.time(18,0),
+                 event_driven=False, shifts=None):
         TaskProcessor.__init__(self, env, name, tick, capability,
                                start_time, end_time, process_time,
-                               down_processors, downweights)
+                               down_processors, downweights, event_driven, shifts)
         if voucher_processor is not None:
             assert isinstance(voucher_processor, VoucherProcessor)
         self.voucher_processor = voucher_processor
         self.voucher_ratio = voucher_ratio
         self.extend_working = extend_working
         self.last_task_time = last_task_time
+        self._last_task_minute = minute_of_day(last_task_time)
+        # the clock is after the last task time outside [00:00, last_task_time]
+        self._last_task_calendar = WorkCalendar(dt.time(0, 0), last_task_time, tick)
         self.working_flag = False
+        # voucher decisions draw from their own stream so they stay in step with
+        # the routing draws of other runs
+        self.voucher_random = GLOBAL_RANDOM
+
+    def tap_routes(self, tap):
+        TaskProcessor.tap_routes(self, tap)
+        if self.voucher_processor is not None:
+            self.voucher_processor = tap(self.voucher_processor)
 
     @property
     def working(self):
-        working_flag = self.clock_time >= self.start_time and \
-                       self.clock_time <= self.end_time
+        working_flag = self.calendar.is_working(self.env.now)
         if self.extend_working:
-            working_flag = working_flag or not self.working_taskstack.is_empty
+            # overtime finishes the working tasks, but not during a break
+            working_flag = working_flag or (not self.working_taskstack.is_empty and
+                                            not self.calendar.on_break(self.env.now))
         return working_flag
 
     @property
     def capable(self):
-        capable_flag = self.working_taskstack.task_count < self.capability
-        if self.clock_time >= self.start_time and self.clock_time <= self.end_time:
+        capable_flag = self.working_taskstack.task_count < self.current_capability
+        if self.calendar.is_working(self.env.now):
             pass
         else:
             capable_flag = capable_flag and \
-                           self.cache_taskstack[0].time_stamps[-1].time.time() < self.last_task_time
+                           self.cache_taskstack[0].time_stamps[-1].clock_minute < self._last_task_minute
         return capable_flag
 
     def _get_new_task(self):
         task = self.cache_taskstack.pop_task()
         task.enter_processor(self)
+        self._schedule_task(task)
         self._add_new_task(task)
 
+    def get_state(self):
+        state = TaskProcessor.get_state(self)
+        state['voucher_random'] = self.voucher_random
+        return state
+
     def _add_new_task(self, task):
-        if self.extend_working and self.clock_time > self.last_task_time:
-            t = task.time_stamps[-2].time.time()
-            if t < self.last_task_time:
+        if self.extend_working and self.clock_minute > self._last_task_minute:
+            t = task.time_stamps[-2].clock_minute
+            if t < self._last_task_minute:
                 self.working_taskstack.add_task(task)
         else:
             self.working_taskstack.add_task(task)
 
+    def _finish_due_tasks(self):
+        TaskProcessor._finish_due_tasks(self)
+        # the tick loop re-adds unfinished tasks every tick, which drops those
+        # arrived after the last task time once the clock passes it
+        if self.extend_working and self.clock_minute > self._last_task_minute:
+            self.working_taskstack.remove_tasks(
+                lambda task: task.time_stamps[-2].clock_minute >= self._last_task_minute)
+
+    def _next_wake_delay(self, working):
+        delay = TaskProcessor._next_wake_delay(self, working)
+        if self.extend_working and not self.working_taskstack.is_empty:
+            # wake when the clock passes the last task time to drop late tasks
+            ltt_delay = self._last_task_calendar.minutes_to_change(self.env.now)
+            delay = ltt_delay if delay is None else min(delay, ltt_delay)
+        return delay
+
     def _push_task_to_next_stage(self, task):
         # determine voucher status
         if self.voucher_processor is not None and task.voucher == VoucherType.NOT_DETERMINED:
-            if np.random.rand(1) < self.voucher_ratio:
+            if self.voucher_random.uniform() < self.voucher_ratio:
                 task.voucher = VoucherType.SUFFICIENT
             else:
                 task.voucher = VoucherType.LACKED
@@ -319,33 +761,83 @@ class InnerTaskProcessor(TaskProcessor):
             task.voucher = VoucherType.SUFFICIENT
         # push task into different branch according to voucher type
         if task.voucher == VoucherType.LACKED:
-            self.voucher_processor.cache_taskstack.add_task(task)
+            self.voucher_processor.receive_task(task, self)
         else:
             self._tradition_push(task)
 
 class VoucherProcessor(TaskProcessor):
-    def __init__(self, env, name, tick=0.5, down_processors=[], downweights=None, process_time_scale=1.0):
+    def __init__(self, env, name, tick=0.5, down_processors=[], downweights=None, process_time_scale=1.0,
+                 event_driven=False):
         TaskProcessor.__init__(self, env, name, tick,
                                down_processors=down_processors,
-                               downweights=downweights)
+                               downweights=downweights,
+                               event_driven=event_driven)
         self.process_time_scale = process_time_scale
 
     def get_process_time(self):
-        return np.random.exponential(self.process_time_scale, size=1)
+        return self.random.exponential(self.process_time_scale)
 
 class ResultProcessor(TaskProcessor):
-    def __init__(self, env, name, tick=1):
-        TaskProcessor.__init__(self, env, name, tick)
+    def __init__(self, env, name, tick=1, event_driven=False, accumulator=None, keep_results=True):
+        """
+        :param accumulator: object whose add(task) is called for every result task
+        :param keep_results: keep result tasks in result_stack
+        """
+        TaskProcessor.__init__(self, env, name, tick, event_driven=event_driven)
         self.result_stack = TaskStack()
+        self.result_count = 0
+        self.accumulator = accumulator
+        self.keep_results = keep_results
+
+    def get_state(self, keep_results=True):
+        state = TaskProcessor.get_state(self)
+        # result tasks are not worked on, and without the results the finished
+        # ones waiting to be recorded are left out as well
+        del state['working_taskstack']
+        if not keep_results:
+            del state['cache_taskstack']
+        # without the results a restored processor starts counting from empty
+        if keep_results:
+            state['result_count'] = self.result_count
+            state['accumulator'] = self.accumulator
+            state['result_stack'] = self.result_stack
+        return state
+
+    def _add_new_task(self, task):
+        # a result task is only recorded, keeping it is up to keep_results
+        pass
+
+    def _record_task(self, task):
+        self.result_count += 1
+        if self.accumulator is not None:
+            self.accumulator.add(task)
+        if self.keep_results:
+            self.result_stack.add_task(task)
 
     def work(self):
+        if self.event_driven:
+            return self._event_work()
+        return self._tick_work()
+
+    def _event_work(self):
         while True:
+            delay = self._align_to_tick()
+            if delay > 0:
+                yield self.env.timeout(delay)
+            yield self._turn()
             while not self.cache_taskstack.is_empty:
-                task = self._get_new_task()
-                self.result_stack.add_task(task)
+                self._record_task(self._get_new_task())
+            # sleep until a finished task arrives
+            self._wakeup = self.env.event()
+            yield self._wakeup
+            self._wakeup = None
+
+    def _tick_work(self):
+        while True:
+            while not self.cache_taskstack.is_empty:
+                self._record_task(self._get_new_task())
             # update time
-            yield self.env.timeout(self.tick)
-            self.time_update(self.tick)
+            yield self._turn(self.tick)
 
 if __name__ == '__main__':
     env = Environment()
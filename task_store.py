@@ -0,0 +1,154 @@
+
+import numpy as np
+import datetime as dt
+from utils import SIMULATION_START
+from schedule import MINUTES_PER_DAY
+
+
+class TaskStore(object):
+    """
+    struct of arrays holding the time stamps of every task in a simulation,
+    tasks are int ids, processors small int ids and times float minutes
+    """
+    def __init__(self, capacity=1024):
+        self.processor_names = []
+        self._processor_ids = {}
+        self.row_count = 0
+        self.task = np.empty(capacity, dtype=np.int32)
+        self.processor = np.empty(capacity, dtype=np.int16)
+        self.time = np.empty(capacity, dtype=np.float64)
+        self.process_time = np.empty(capacity, dtype=np.float32)
+        # row of the previous time stamp of the same task, -1 for the first one
+        self.prev = np.empty(capacity, dtype=np.int32)
+
+    @property
+    def capacity(self):
+        return self.time.shape[0]
+
+    def processor_id(self, name):
+        pid = self._processor_ids.get(name)
+        if pid is None:
+            pid = len(self.processor_names)
+            self._processor_ids[name] = pid
+            self.processor_names.append(name)
+        return pid
+
+    def add_time_stamp(self, task_id, processor_name, time, process_time=-1, prev=-1):
+        if self.row_count >= self.capacity:
+            self._grow()
+        row = self.row_count
+        self.task[row] = task_id
+        self.processor[row] = self.processor_id(processor_name)
+        self.time[row] = time
+        self.process_time[row] = process_time
+        self.prev[row] = prev
+        self.row_count += 1
+        return row
+
+    def _grow(self):
+        capacity = self.capacity * 2
+        for name in ['task', 'processor', 'time', 'process_time', 'prev']:
+            column = getattr(self, name)
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self.row_count] = column[:self.row_count]
+            setattr(self, name, grown)
+
+    def rows(self, last_row):
+        # rows of a task in time order, given the row of its last time stamp
+        rows = []
+        row = last_row
+        while row >= 0:
+            rows.append(row)
+            row = self.prev[row]
+        rows.reverse()
+        return rows
+
+    def time_consuming(self, last_row, voucher_processor_name=None, with_voucher=False):
+        # same result as Task.time_consuming, computed on float minutes
+        voucher_ids = set(self._processor_ids[name] for name in voucher_processor_name or []
+                          if name in self._processor_ids)
+        end_time = self.time[last_row]
+        voucher_time_list = []
+        row = last_row
+        while True:
+            if self.processor[row] in voucher_ids:
+                voucher_time_list.append(self.time[row])
+            if self.prev[row] < 0:
+                break
+            row = self.prev[row]
+        start_time = self.time[row]
+        voucher_time_list.reverse()
+        voucher_time = 0.
+        for i in range(int(len(voucher_time_list) / 2)):
+            voucher_time += voucher_time_list[2*i+1] - voucher_time_list[2*i]
+        if with_voucher:
+            time_consuming = end_time - start_time
+        else:
+            time_consuming = end_time - start_time - voucher_time
+        return dt.timedelta(minutes=float(time_consuming))
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes
+                   for name in ['task', 'processor', 'time', 'process_time', 'prev'])
+
+
+class StoredTimeStamp(object):
+    """
+    read only view of one row of a task store, mirroring TaskTimeStamp
+    """
+    __slots__ = ('store', 'row')
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    @property
+    def processor(self):
+        return self.store.processor_names[self.store.processor[self.row]]
+
+    @property
+    def minute(self):
+        return float(self.store.time[self.row])
+
+    @property
+    def clock_minute(self):
+        return self.minute % MINUTES_PER_DAY
+
+    @property
+    def time(self):
+        return SIMULATION_START + dt.timedelta(minutes=self.minute)
+
+    @property
+    def process_time(self):
+        return float(self.store.process_time[self.row])
+
+
+class StoredTimeStamps(object):
+    """
+    sequence view over the time stamps of one task in a task store
+    """
+    __slots__ = ('store', 'last_row', 'count')
+
+    def __init__(self, store, last_row, count):
+        self.store = store
+        self.last_row = last_row
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for row in self.store.rows(self.last_row):
+            yield StoredTimeStamp(self.store, row)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if index < 0 or index >= self.count:
+            raise IndexError('time stamp index out of range')
+        # walk back from the last row, recent stamps are the common case
+        row = self.last_row
+        for _ in range(self.count - 1 - index):
+            row = self.store.prev[row]
+        return StoredTimeStamp(self.store, row)
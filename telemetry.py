@@ -0,0 +1,126 @@
+
+import numpy as np
+
+# minutes between samples when only a telemetry file is asked for
+TELEMETRY_INTERVAL = 1.
+DOWNSAMPLE_METHODS = ['mean', 'max', 'last']
+
+
+class TelemetrySeries(object):
+    """
+    samples of every processor in time order, one column per processor:
+    cache: tasks waiting in the cache task stack
+    working: tasks in the working task stack
+    busy: working tasks per staff at work, nan for processors of unlimited capability
+    """
+    def __init__(self, processor_names, interval, time, cache, working, busy):
+        self.processor_names = list(processor_names)
+        self.interval = interval
+        self.time = time
+        self.cache = cache
+        self.working = working
+        self.busy = busy
+
+    @property
+    def sample_count(self):
+        return len(self.time)
+
+    def column(self, name, series='cache'):
+        # one series of one processor, e.g. column('os_processor') is its backlog curve
+        if series not in ['cache', 'working', 'busy']:
+            raise ValueError('series should be cache, working or busy')
+        return getattr(self, series)[:, self.processor_names.index(name)]
+
+    def downsample(self, factor, how='mean'):
+        """
+        one sample per factor samples, the last incomplete group is dropped
+        :param how: mean, max or last of each group
+        """
+        if how not in DOWNSAMPLE_METHODS:
+            raise ValueError('downsample method should be one of {}'.format(DOWNSAMPLE_METHODS))
+        count = self.sample_count // factor
+        def reduce(values):
+            groups = values[:count * factor].reshape((count, factor) + values.shape[1:])
+            if how == 'mean':
+                return groups.mean(axis=1, dtype=np.float64).astype(np.float32)
+            if how == 'max':
+                return groups.max(axis=1)
+            return groups[:, -1]
+        # each sample is stamped with the start of its group
+        return TelemetrySeries(self.processor_names, self.interval * factor,
+                               self.time[:count * factor:factor], reduce(self.cache),
+                               reduce(self.working), reduce(self.busy))
+
+    def save(self, path):
+        # compressed npz file, see load_telemetry
+        np.savez_compressed(path, processor_names=np.array(self.processor_names), interval=self.interval,
+                            time=self.time, cache=self.cache, working=self.working, busy=self.busy)
+
+
+def load_telemetry(path):
+    with np.load(path) as data:
+        return TelemetrySeries(data['processor_names'].tolist(), data['interval'].item(), data['time'],
+                               data['cache'], data['working'], data['busy'])
+
+
+class Telemetry(object):
+    """
+    recorder sampling the queues of every processor at a fixed interval of
+    simulation time into preallocated ring buffers, the oldest samples are
+    overwritten once capacity samples are taken
+    """
+    def __init__(self, processors, interval=TELEMETRY_INTERVAL, capacity=43200):
+        """
+        :param processors: processors of one simulation environment
+        :param interval: minutes of simulation time between samples
+        :param capacity: samples kept, 30 days of one minute samples by default
+        """
+        self.processors = list(processors)
+        self.env = self.processors[0].env
+        self.interval = interval
+        self.capacity = capacity
+        self.sample_count = 0
+        count = len(self.processors)
+        self._time = np.zeros(capacity)
+        self._cache = np.zeros((capacity, count), dtype=np.int32)
+        self._working = np.zeros((capacity, count), dtype=np.int32)
+        self._busy = np.zeros((capacity, count), dtype=np.float32)
+
+    def sample(self):
+        row = self.sample_count % self.capacity
+        self._time[row] = self.env.now
+        cache = self._cache[row]
+        working = self._working[row]
+        busy = self._busy[row]
+        for column, processor in enumerate(self.processors):
+            working_count = processor.working_taskstack.task_count
+            capability = processor.current_capability
+            cache[column] = processor.cache_taskstack.task_count
+            working[column] = working_count
+            if capability == np.inf:
+                busy[column] = np.nan
+            else:
+                busy[column] = working_count / capability if capability else 0
+        self.sample_count += 1
+
+    def work(self):
+        # sampling process, started with the processors
+        while True:
+            self.sample()
+            yield self.env.timeout(self.interval)
+
+    def series(self):
+        # the kept samples in time order
+        if self.sample_count <= self.capacity:
+            order = np.arange(self.sample_count)
+        else:
+            order = (np.arange(self.capacity) + self.sample_count) % self.capacity
+        return TelemetrySeries([processor.name for processor in self.processors], self.interval,
+                               self._time[order], self._cache[order], self._working[order], self._busy[order])
+
+    @property
+    def nbytes(self):
+        return self._time.nbytes + self._cache.nbytes + self._working.nbytes + self._busy.nbytes
+
+    def save(self, path):
+        self.series().save(path)
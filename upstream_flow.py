@@ -0,0 +1,248 @@
+
+import datetime as dt
+import hashlib
+import json
+import os
+import uuid
+import numpy as np
+from task import Task, TaskTimeStamp, VoucherType, turn_event, proxy_work
+
+def _key_value(value):
+    # json value of an attribute json can not write
+    if isinstance(value, dt.time):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def flow_path(flow_dir, content):
+    """
+    file of the flow recorded under content, a dict of everything the
+    upstream stages of a run depend on
+    """
+    key = hashlib.sha1(json.dumps(content, sort_keys=True, default=_key_value).encode('utf-8')).hexdigest()
+    return os.path.join(flow_dir, '{}.npz'.format(key))
+
+
+class UpstreamFlow(object):
+    """
+    tasks the upstream stages of a run handed to the other stages, in columns:
+    one row per hand-over (simulation time, resumptions of downstream work
+    loops already made at that time, stage id of the receiver, task count),
+    one row per handed over task (id, task type, voucher, time stamp count)
+    and one row per time stamp the tasks had when handed over
+    """
+    def __init__(self, upstream, processor_names):
+        self.upstream = list(upstream)
+        self.processor_names = list(processor_names)
+        self._processor_codes = dict((name, code) for code, name in enumerate(self.processor_names))
+        self.time = []
+        self.resumes = []
+        self.stage = []
+        self.task_count = []
+        self.task_id = []
+        self.task_type = []
+        self.voucher = []
+        self.stamp_count = []
+        self.stamp_processor = []
+        self.stamp_minute = []
+        self.stamp_process_time = []
+        # first task and time stamp of each hand-over, set by load_flow
+        self._task_start = None
+        self._stamp_start = None
+
+    def __len__(self):
+        return len(self.time)
+
+    def add(self, time, resumes, stage_id, tasks):
+        self.time.append(time)
+        self.resumes.append(resumes)
+        self.stage.append(stage_id)
+        self.task_count.append(len(tasks))
+        codes = self._processor_codes
+        for task in tasks:
+            self.task_id.append(task.id)
+            self.task_type.append(task.task_type)
+            self.voucher.append(task.voucher.value)
+            self.stamp_count.append(len(task.time_stamps))
+            for stamp in task.time_stamps:
+                self.stamp_processor.append(codes[stamp.processor])
+                self.stamp_minute.append(stamp.minute)
+                self.stamp_process_time.append(stamp.process_time)
+
+    def tasks(self, row):
+        # new tasks as they were handed over at hand-over row
+        tasks = []
+        task_row = self._task_start[row]
+        stamp_row = self._stamp_start[row]
+        names = self.processor_names
+        for task_row in range(task_row, task_row + self.task_count[row]):
+            task = Task(self.task_id[task_row], self.task_id[task_row])
+            task.task_type = self.task_type[task_row]
+            task.voucher = VoucherType(self.voucher[task_row])
+            stamp_end = stamp_row + self.stamp_count[task_row]
+            task.time_stamps = [TaskTimeStamp.from_values(names[self.stamp_processor[i]], self.stamp_minute[i],
+                                                          self.stamp_process_time[i])
+                                for i in range(stamp_row, stamp_end)]
+            stamp_row = stamp_end
+            tasks.append(task)
+        return tasks
+
+    def save(self, path):
+        # runs of a sweep may record the same flow at once, the last one is kept
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = '{}.tmp.{}'.format(path, uuid.uuid4().hex)
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, upstream=np.array(self.upstream), processor_names=np.array(self.processor_names),
+                     time=np.array(self.time, dtype=np.float64), resumes=np.array(self.resumes, dtype=np.int32),
+                     stage=np.array(self.stage, dtype=np.int16), task_count=np.array(self.task_count, dtype=np.int32),
+                     task_id=np.array(self.task_id, dtype=np.int64), task_type=np.array(self.task_type, dtype=np.int16),
+                     voucher=np.array(self.voucher, dtype=np.int8),
+                     stamp_count=np.array(self.stamp_count, dtype=np.int16),
+                     stamp_processor=np.array(self.stamp_processor, dtype=np.int16),
+                     stamp_minute=np.array(self.stamp_minute, dtype=np.float64),
+                     stamp_process_time=np.array(self.stamp_process_time, dtype=np.float64))
+        os.replace(tmp_path, path)
+
+
+def load_flow(path):
+    with np.load(path) as data:
+        flow = UpstreamFlow(data['upstream'].tolist(), data['processor_names'].tolist())
+        # lists, as single values are read from them one at a time
+        for name in ['time', 'resumes', 'stage', 'task_count', 'task_id', 'task_type', 'voucher',
+                     'stamp_count', 'stamp_processor', 'stamp_minute', 'stamp_process_time']:
+            setattr(flow, name, data[name].tolist())
+        task_start = np.concatenate([[0], np.cumsum(data['task_count'])])
+        stamp_start = np.concatenate([[0], np.cumsum(data['stamp_count'])])
+    flow._task_start = task_start[:-1].tolist()
+    flow._stamp_start = stamp_start[task_start[:-1]].tolist()
+    return flow
+
+
+class FlowTap(object):
+    # takes the place of a downstream stage in the routes of an upstream one
+    def __init__(self, cut, processor):
+        self.cut = cut
+        self.processor = processor
+
+    def receive_task(self, task, sender=None):
+        self.cut.record(self.processor, [task])
+
+    def receive_tasks(self, tasks, sender=None):
+        self.cut.record(self.processor, list(tasks))
+
+
+class FlowCut(object):
+    """
+    run of a network cut after its upstream stages, the stages no changed
+    parameter reaches. Without a flow every stage runs and the tasks the
+    upstream stages hand over are recorded; with one only the downstream
+    stages run and get the recorded tasks. Either way the tasks are handed
+    over at the same point: before the next resumption of a downstream work
+    loop at their time, or after every other event of their time if none
+    follows, so with per processor random streams a replay is the recording
+    run over again. The tick engine takes handed over tasks at the next
+    resumption anyway, so its runs are those of the uncut network; so are
+    event driven runs, unless an upstream stage started after a downstream
+    one hands tasks to it, which the uncut network holds to the next tick
+    """
+    def __init__(self, processors, upstream, flow=None, path=None):
+        """
+        :param processors: processors of one simulation environment in start order
+        :param upstream: names of the upstream stages
+        :param flow: UpstreamFlow to replay, None records one
+        :param path: file the recorded flow is saved to
+        """
+        self.processors = list(processors)
+        self.env = self.processors[0].env
+        self.upstream = list(upstream)
+        self.path = path
+        self.recording = flow is None
+        self.flow = UpstreamFlow(upstream, [processor.name for processor in self.processors]) \
+            if flow is None else flow
+        self._stage_ids = dict((processor.name, stage_id) for stage_id, processor in enumerate(self.processors))
+        # resumptions of downstream work loops at the current time
+        self._time = None
+        self._resumes = 0
+        # tasks recorded in this run, and the next hand-over
+        self._tasks = []
+        self._position = 0
+        self._flush_time = None
+        if self.recording:
+            for processor in self.processors:
+                if processor.name in self.upstream:
+                    processor.tap_routes(self._tap)
+
+    def _tap(self, processor):
+        if processor.name in self.upstream:
+            return processor
+        return FlowTap(self, processor)
+
+    def simulates(self, processor):
+        # upstream processors only run while recording
+        return self.recording or processor.name not in self.upstream
+
+    def _resumes_now(self):
+        return self._resumes if self._time == self.env.now else 0
+
+    def record(self, processor, tasks):
+        now = self.env.now
+        self.flow.add(now, self._resumes_now(), self._stage_ids[processor.name], tasks)
+        self._tasks.append(tasks)
+        if self._flush_time != now:
+            self._flush_time = now
+            self.env.process(self._flush())
+
+    def work(self, processor, work):
+        # work loop of processor, counting its resumptions if it is downstream
+        if processor.name in self.upstream:
+            return work
+        return self._counted(work)
+
+    def _counted(self, work):
+        return proxy_work(work, self._resume)
+
+    def _resume(self, send, value):
+        # hand over the tasks due before this resumption, then count it
+        self._hand_over(self._resumes_now())
+        if self._time != self.env.now:
+            self._time = self.env.now
+            self._resumes = 0
+        self._resumes += 1
+        return send(value)
+
+    def _hand_over(self, resumes):
+        # hand the tasks due up to resumes resumptions of this time to their stages
+        flow = self.flow
+        now = self.env.now
+        while self._position < len(flow):
+            row = self._position
+            time = flow.time[row]
+            if time > now or (time == now and flow.resumes[row] > resumes):
+                break
+            tasks = self._tasks[row] if self.recording else flow.tasks(row)
+            self.processors[flow.stage[row]].receive_tasks(tasks)
+            self._position += 1
+
+    def _flush(self):
+        # hand over the tasks no downstream resumption of their time follows
+        while self.env.peek() == self.env.now:
+            # wait behind the turns of event driven processors too
+            yield turn_event(self.env, len(self.processors))
+        self._hand_over(np.inf)
+
+    def replay(self):
+        # process flushing the recorded tasks at their times
+        while self._position < len(self.flow):
+            time = self.flow.time[self._position]
+            if time > self.env.now:
+                yield self.env.timeout(time - self.env.now)
+            else:
+                yield self.env.process(self._flush())
+
+    def finish(self):
+        if self.recording and self.path is not None:
+            self.flow.save(self.path)
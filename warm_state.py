@@ -0,0 +1,86 @@
+
+import pickle
+import numpy as np
+from task import ResultProcessor
+
+# engine options a warm state can only be restored under
+STATE_OPTIONS = ['event_driven', 'columnar_store', 'streaming_metrics']
+
+
+class WarmState(object):
+    """
+    pickled state of a simulation network at one simulation time: queues,
+    in-flight tasks, processor clocks and random states. Restoring it into
+    a Simulation with the same processors resumes the run from that time,
+    each restore gets its own copy of the tasks
+    """
+    def __init__(self, now, tick, options, processor_names, payload, keep_results=True):
+        self.now = now
+        self.tick = tick
+        self.options = options
+        self.processor_names = processor_names
+        self.payload = payload
+        # whether the tasks finished before the snapshot are in the results
+        self.keep_results = keep_results
+
+    @classmethod
+    def capture(cls, sim, keep_results=True):
+        """
+        :param sim: Simulation after run()
+        :param keep_results: keep the tasks finished so far, otherwise the restored
+                             run only reports the tasks finishing after the snapshot
+        """
+        processors = {}
+        for processor in sim.processor_list:
+            if isinstance(processor, ResultProcessor):
+                processors[processor.name] = processor.get_state(keep_results)
+            else:
+                processors[processor.name] = processor.get_state()
+        state = {'processors': processors,
+                 'task_store': sim.task_store,
+                 'np_random_state': np.random.get_state()}
+        return cls(sim.env.now, sim.tick,
+                   dict((name, getattr(sim, name)) for name in STATE_OPTIONS),
+                   [processor.name for processor in sim.processor_list],
+                   pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL), keep_results)
+
+    def check(self, sim):
+        # the network must have the same processors on the same tick grid
+        names = [processor.name for processor in sim.processor_list]
+        if names != self.processor_names:
+            raise ValueError('warm state processors {} do not match {}'.format(self.processor_names, names))
+        if sim.tick != self.tick:
+            raise ValueError('warm state was taken with tick {}, not {}'.format(self.tick, sim.tick))
+        for name, value in self.options.items():
+            if getattr(sim, name) != value:
+                raise ValueError('warm state was taken with {}={}'.format(name, value))
+
+    def apply(self, sim, restore_random=True):
+        """
+        load a fresh copy of the state into the processors of sim, which must
+        have been built in an environment starting at self.now
+        """
+        state = pickle.loads(self.payload)
+        if restore_random:
+            np.random.set_state(state['np_random_state'])
+        if state['task_store'] is not None:
+            sim.task_store = state['task_store']
+            sim.generator.task_store = state['task_store']
+        for processor in sim.processor_list:
+            processor.set_state(state['processors'][processor.name], restore_random)
+
+    @property
+    def nbytes(self):
+        return len(self.payload)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_warm_state(path):
+    with open(path, 'rb') as f:
+        warm_state = pickle.load(f)
+    if not isinstance(warm_state, WarmState):
+        raise ValueError('{} does not hold a warm state'.format(path))
+    return warm_state